@@ -0,0 +1,85 @@
+"""
+    Server Allocations
+
+    This example checks that serving the common read and write requests does
+    not allocate memory once the server is warmed up. Requests are passed to
+    handle_request of a TCP and an RTU server whose responses go through the
+    real TCPServer._send and RTUServer._send into a socket and a UART that
+    discard them, and tracemalloc measures what is left behind.
+
+    Run it on CPython from a directory containing the uModBus package:
+
+        python examples/server_allocations.py
+
+	Written by FACTS Engineering
+	Copyright (c) 2023 FACTS Engineering, LLC
+	Licensed under the MIT license.
+
+"""
+
+import struct
+import tracemalloc
+from uModBus.serial import RTUServer
+from uModBus.tcp import TCPServer
+
+ROUNDS = 1000
+MAX_GROWTH = 1024 # bytes allowed to remain allocated after all rounds
+MAX_PEAK = 2048 # bytes allowed above the starting point at any time
+
+REQUESTS = (
+    struct.pack('>BBHH', 1, 1, 0, 2000), # read coils
+    struct.pack('>BBHH', 1, 3, 0, 125), # read holding registers
+    struct.pack('>BBHH', 1, 4, 0, 125), # read input registers
+    struct.pack('>BBHH', 1, 5, 10, 0xFF00), # write single coil
+    struct.pack('>BBHH', 1, 6, 10, 1234), # write single register
+    struct.pack('>BBHHB', 1, 15, 20, 10, 2) + b'\xa5\x02', # write multiple coils
+    struct.pack('>BBHHB', 1, 16, 20, 2, 4) + b'\x00\x07\xbe\xef', # write multiple registers
+    struct.pack('>BBHH', 1, 3, 120, 10), # exception, illegal data address
+)
+
+
+class DiscardingPort:
+    baudrate = 115200
+
+    def send(self, data):
+        pass
+
+    def write(self, data):
+        pass
+
+
+class Connection:
+    sock = DiscardingPort()
+
+
+def servers():
+    sizes = dict(number_coils=2000, number_discrete_inputs=2000,
+                 number_holding_registers=125, number_input_registers=125)
+    tcp_server = TCPServer(None, '127.0.0.1', unit_addr=1, **sizes)
+    tcp_server._current = Connection()
+    tcp_server._req_tid = 1
+    rtu_server = RTUServer(DiscardingPort(), unit_addr=1, **sizes)
+    rtu_server._t35chars = 0
+    return (('TCPServer', tcp_server), ('RTUServer', rtu_server))
+
+
+def measure(server):
+    # the first round fills the caches of response views
+    for request in REQUESTS:
+        server.handle_request(request)
+
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for _ in range(ROUNDS):
+        for request in REQUESTS:
+            server.handle_request(request)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current - start, peak - start
+
+
+for name, server in servers():
+    growth, peak = measure(server)
+    print(f'{name:<10} {ROUNDS * len(REQUESTS)} requests  {growth:6d} bytes retained  {peak:6d} bytes peak')
+    assert growth <= MAX_GROWTH, f'{name} retained {growth} bytes'
+    assert peak <= MAX_PEAK, f'{name} peaked at {peak} bytes'
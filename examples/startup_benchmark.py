@@ -0,0 +1,59 @@
+"""
+    Startup Benchmark
+
+    This example measures the time and memory it takes to import the TCP and RTU
+    parts of the library.
+
+    On CircuitPython copy it to the board and it reports the import of MODULE,
+    reset the board between runs so the module is not already loaded.
+    On CPython run it from a directory containing the uModBus package and every
+    module is measured in a fresh interpreter:
+
+        python examples/startup_benchmark.py
+
+	Written by FACTS Engineering
+	Copyright (c) 2023 FACTS Engineering, LLC
+	Licensed under the MIT license.
+
+"""
+
+import gc
+import sys
+import time
+
+MODULE = 'uModBus.tcp' # module measured on CircuitPython
+MODULES = ('uModBus.tcp', 'uModBus.serial', 'uModBus.common')
+
+
+def measure(module):
+    gc.collect()
+    free_before = gc.mem_free() if hasattr(gc, 'mem_free') else None
+    start = time.monotonic_ns()
+    __import__(module)
+    elapsed_ms = (time.monotonic_ns() - start) / 1e6
+    gc.collect()
+    used = None if free_before is None else free_before - gc.mem_free()
+    return elapsed_ms, used
+
+
+def measure_cpython(module):
+    import resource
+    import tracemalloc
+
+    tracemalloc.start()
+    elapsed_ms, _ = measure(module)
+    current, peak = tracemalloc.get_traced_memory()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'{module:<16} {elapsed_ms:8.2f} ms  {current / 1024:8.1f} KiB retained  '
+          f'{peak / 1024:8.1f} KiB peak  {rss_kb:8d} KiB max RSS')
+
+
+if sys.implementation.name != 'cpython':
+    elapsed_ms, used = measure(MODULE)
+    print(f'{MODULE} imported in {elapsed_ms:.2f} ms using {used} bytes')
+elif len(sys.argv) > 2 and sys.argv[1] == '--child':
+    measure_cpython(sys.argv[2])
+else:
+    import subprocess
+    for module in MODULES:
+        subprocess.run([sys.executable, __file__, '--child', module], check=True)
@@ -0,0 +1,13 @@
+# The library is imported as uModBus, but the directory in a checkout is uModbus.
+# On case sensitive file systems register the directory under the import name.
+
+import os
+import sys
+import types
+
+try:
+    import uModBus
+except ImportError:
+    package = types.ModuleType('uModBus')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uModbus')]
+    sys.modules['uModBus'] = package
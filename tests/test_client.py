@@ -0,0 +1,27 @@
+import pytest
+from uModBus.common import Client
+
+
+class _EchoClient(Client):
+    """A client whose server echoes write requests, like a real write single coil response"""
+
+    def __init__(self):
+        super().__init__(1)
+        self.sent = []
+
+    def _send_receive(self, unit, modbus_pdu, count):
+        self.sent.append(bytes(modbus_pdu))
+        return modbus_pdu[1:]
+
+
+@pytest.mark.parametrize('value, encoded', ((1, b'\xff\x00'), (True, b'\xff\x00'), (0, b'\x00\x00'), (False, b'\x00\x00')))
+def test_write_single_coil_encodes_on_and_off(value, encoded):
+    client = _EchoClient()
+    assert client.write_single_coil(4, value) is True
+    assert client.sent == [b'\x05\x00\x04' + encoded]
+
+
+def test_write_single_coil_reports_a_wrong_echo():
+    client = _EchoClient()
+    client._send_receive = lambda unit, modbus_pdu, count: b'\x00\x04\x00\x00'
+    assert client.write_single_coil(4, 1) is False
@@ -0,0 +1,66 @@
+import struct
+from uModBus.monitor import RTUMonitor, pair_frames
+from uModBus.serial import _calculate_crc16
+
+
+class _Bus:
+    """A UART that has already received all of data"""
+    baudrate = 115200
+
+    def __init__(self, data):
+        self._data = bytearray(data)
+
+    @property
+    def in_waiting(self):
+        return len(self._data)
+
+    def readinto(self, buf):
+        size = min(len(buf), len(self._data))
+        buf[:size] = self._data[:size]
+        del self._data[:size]
+        return size
+
+
+def _frame(*fields):
+    frame = bytes(fields[:2]) + struct.pack('>' + 'H' * (len(fields) - 2), *fields[2:])
+    return frame + _calculate_crc16(frame)
+
+
+def _read_all(data):
+    monitor = RTUMonitor(_Bus(data))
+    # no silence is ever seen, frames can only be delimited by their length
+    monitor._t35chars = 1e9
+    frames = []
+    while True:
+        frame = monitor.read_frame()
+        if frame is None:
+            return monitor, frames
+        frames.append(frame)
+
+
+def test_bad_crc_does_not_swallow_the_following_frames():
+    request = _frame(1, 3, 0, 2)
+    response = bytes((1, 3, 4, 0, 7, 0, 8))
+    response += _calculate_crc16(response)
+    corrupted = bytearray(_frame(2, 6, 10, 99))
+    corrupted[4] ^= 0xFF
+    data = request + response + bytes(corrupted) + request + response
+
+    monitor, frames = _read_all(data)
+
+    assert [frame.data for frame in frames] == [request, response, bytes(corrupted), request, response]
+    assert [frame.valid for frame in frames] == [True, True, False, True, True]
+    assert monitor.crc_errors == 1
+    exchanges = list(pair_frames(frames))
+    assert [exchange.response is not None for exchange in exchanges] == [True, True]
+
+
+def test_realigns_after_a_truncated_frame():
+    request = _frame(1, 3, 0, 2)
+    write = _frame(1, 6, 10, 99)
+    data = write[:5] + request + _frame(1, 6, 11, 5)
+
+    monitor, frames = _read_all(data)
+
+    assert [frame.data for frame in frames] == [write[:5], request, _frame(1, 6, 11, 5)]
+    assert [frame.valid for frame in frames] == [False, True, True]
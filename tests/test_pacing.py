@@ -0,0 +1,45 @@
+import uModBus.common as common
+from uModBus.common import _TokenBucket, _bucket_size, _next_slot
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_next_slot_skips_missed_slots():
+    assert _next_slot(10.0, 1.0, 10.0) == 11.0
+    assert _next_slot(10.0, 1.0, 10.5) == 11.0
+    assert _next_slot(10.0, 1.0, 13.2) == 14.0
+
+
+def test_bucket_size_holds_at_least_one_token():
+    assert _bucket_size(None, None) is None
+    assert _bucket_size(0.5, None) == 1
+    assert _bucket_size(5, None) == 5
+    assert _bucket_size(0.5, 3) == 3
+
+
+def test_token_bucket_refills_at_rate_up_to_burst(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(common, 'time', clock)
+    bucket = _TokenBucket(2)
+    assert [bucket.take(1, 2) for _ in range(3)] == [True, True, False]
+    clock.now += 0.5
+    assert not bucket.take(1, 2)
+    clock.now += 10
+    assert [bucket.take(1, 2) for _ in range(3)] == [True, True, False]
+
+
+def test_slow_rate_still_allows_one_token(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(common, 'time', clock)
+    burst = _bucket_size(0.5, None)
+    bucket = _TokenBucket(burst)
+    assert bucket.take(0.5, burst)
+    assert not bucket.take(0.5, burst)
+    clock.now += 2
+    assert bucket.take(0.5, burst)
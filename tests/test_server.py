@@ -0,0 +1,150 @@
+import struct
+import pytest
+import uModBus.const as Const
+from uModBus.common import ModbusException
+from uModBus.serial import RTUServer, _calculate_crc16, _rtu_handle_frame
+from uModBus.tcp import TCPServer
+from uModBus.udp import UDPServer
+
+_SIZES = dict(number_coils=16, number_discrete_inputs=16, number_holding_registers=16, number_input_registers=16,
+              file_records={1: 4}, fifo_queues=[0x10])
+
+
+class _Port:
+    """Collects what a server sends, standing in for a UART or a connected socket"""
+    baudrate = 115200
+
+    def __init__(self):
+        self.frames = []
+
+    def write(self, data):
+        self.frames.append(bytes(data))
+
+    def send(self, data):
+        self.frames.append(bytes(data))
+
+
+class _Connection:
+    def __init__(self):
+        self.sock = _Port()
+
+
+class _Datagrams:
+    """A socket module whose sockets receive datagrams from a list"""
+    AF_INET = 2
+    SOCK_DGRAM = 2
+
+    def __init__(self, datagrams):
+        self.datagrams = list(datagrams)
+        self.frames = []
+
+    def socket(self, *args):
+        return self
+
+    def bind(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def recvfrom_into(self, buf):
+        if not self.datagrams:
+            raise OSError('timed out')
+        datagram = self.datagrams.pop(0)
+        buf[:len(datagram)] = datagram
+        return len(datagram), ('127.0.0.1', 5020)
+
+    def sendto(self, data, address):
+        self.frames.append(bytes(data))
+
+
+def _mbap(request):
+    return struct.pack('>HHH', 1, 0, len(request)) + request
+
+
+def _rtu_exchange(request):
+    """Return the unit id and PDU of every frame sent in answer to request, and the server"""
+    server = RTUServer(_Port(), unit_addr=1, **_SIZES)
+    server._t35chars = 0
+    _rtu_handle_frame(server, request + _calculate_crc16(request))
+    for frame in server._uart.frames:
+        assert _calculate_crc16(frame[:-2]) == frame[-2:]
+    return [frame[:-2] for frame in server._uart.frames], server
+
+
+def _tcp_exchange(request):
+    server = TCPServer(None, '127.0.0.1', **_SIZES)
+    server._current = _Connection()
+    server._handle_adu(server._current, memoryview(_mbap(request)))
+    return [frame[Const.MBAP_HDR_LENGTH - 1:] for frame in server._current.sock.frames], server
+
+
+def _udp_exchange(request):
+    socket = _Datagrams([_mbap(request)])
+    server = UDPServer(socket, '127.0.0.1', **_SIZES)
+    server.poll()
+    return [frame[Const.MBAP_HDR_LENGTH - 1:] for frame in socket.frames], server
+
+
+EXCHANGES = (_rtu_exchange, _tcp_exchange, _udp_exchange)
+
+TRUNCATED = (
+    b'\x01\x01',
+    b'\x01\x03\x00\x00',
+    b'\x01\x05\x00\x01',
+    b'\x01\x06\x00\x01',
+    b'\x01\x0f\x00\x01',
+    b'\x01\x10\x00\x01',
+    b'\x01\x08',
+    b'\x01\x14',
+    b'\x01\x15',
+    b'\x01\x14\x07',
+    b'\x01\x18',
+    b'\x01\x18\x00',
+    b'\x01\x2b',
+    b'\x01\x2b\x0e',
+)
+
+
+@pytest.mark.parametrize('exchange', EXCHANGES)
+@pytest.mark.parametrize('request_pdu', TRUNCATED)
+def test_truncated_request_is_answered_with_one_exception(exchange, request_pdu):
+    frames, server = exchange(request_pdu)
+    assert len(frames) == 1
+    assert frames[0][:2] == bytes((1, request_pdu[1] + Const.ERROR_BIAS))
+    assert server.counters.bus_exceptions == 1
+
+
+@pytest.mark.parametrize('exchange', EXCHANGES)
+def test_complete_request_is_answered(exchange):
+    frames, server = exchange(b'\x01\x03\x00\x00\x00\x02')
+    assert frames == [b'\x01\x03\x04\x00\x00\x00\x00']
+    assert server.counters.bus_exceptions == 0
+
+
+ONE_EXCEPTION = (
+    (struct.pack('>BBHHB', 1, 15, 10, 10, 2) + b'\xff\x03', Const.ILLEGAL_DATA_ADDRESS),
+    (struct.pack('>BBHHB', 1, 15, 0, 10, 1) + b'\xff', Const.ILLEGAL_DATA_VALUE),
+    (struct.pack('>BBHHB', 1, 16, 15, 2, 4) + b'\x00\x01\x00\x02', Const.ILLEGAL_DATA_ADDRESS),
+    (struct.pack('>BBHHB', 1, 16, 0, 2, 2) + b'\x00\x01', Const.ILLEGAL_DATA_VALUE),
+)
+
+
+@pytest.mark.parametrize('exchange', EXCHANGES)
+@pytest.mark.parametrize('request_pdu, exception_code', ONE_EXCEPTION)
+def test_invalid_write_is_answered_with_one_exception(exchange, request_pdu, exception_code):
+    frames, server = exchange(request_pdu)
+    assert frames == [bytes((1, request_pdu[1] + Const.ERROR_BIAS, exception_code))]
+    assert server.counters.bus_exceptions == 1
+
+
+@pytest.mark.parametrize('exchange', EXCHANGES)
+def test_raised_exception_is_answered_once(exchange, monkeypatch):
+    def handle_request(self, data):
+        raise ModbusException(data[1], Const.SERVER_DEVICE_BUSY, self)
+
+    for server_class in (RTUServer, TCPServer, UDPServer):
+        monkeypatch.setattr(server_class, 'handle_request', handle_request)
+    frames, server = exchange(b'\x01\x03\x00\x00\x00\x02')
+    assert frames == [bytes((1, 0x83, Const.SERVER_DEVICE_BUSY))]
+    assert server.counters.bus_exceptions == 1
@@ -0,0 +1,223 @@
+# Command line Modbus client for commissioning and data capture on hosts running CPython
+#
+#   python -m uModBus read tcp 192.168.1.177 --points holding:0:10
+#   python -m uModBus write rtu /dev/ttyUSB0 --baudrate 19200 --unit 2 --table coil --address 4 1
+#   python -m uModBus poll tcp 192.168.1.177 --points holding:0:10,coil:0:8 --rate 10 --format jsonl
+#   python -m uModBus poll rtu /dev/ttyUSB0 --map meter.csv --rate 2 --output meter.csv
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import argparse
+import json
+import sys
+import time
+from uModBus.common import _next_slot
+from uModBus.regmap import RegisterMap, TABLES
+
+
+def _client(args):
+    if args.transport == 'tcp':
+        import socket
+        from uModBus.tcp import TCPClient
+        return TCPClient(socket, args.target, server_port=args.port, default_unit_id=args.unit, timeout=args.timeout)
+
+    try:
+        import serial
+    except ImportError:
+        sys.exit('RTU needs pyserial: pip install pyserial')
+    from uModBus.serial import RTUClient
+    uart = serial.Serial(args.target, args.baudrate, parity=args.parity, stopbits=args.stop_bits, timeout=0)
+    return RTUClient(uart, default_unit_id=args.unit, timeout=args.timeout, stop_bits=args.stop_bits)
+
+
+def _points(text, signed):
+    """Turn table:address[:count] items into register map points"""
+    points = []
+    for item in text.split(','):
+        fields = item.strip().split(':')
+        table = fields[0]
+        if table not in TABLES:
+            raise ValueError(f'unknown table {table}, expected one of {", ".join(TABLES)}')
+        address = int(fields[1], 0)
+        count = int(fields[2], 0) if len(fields) > 2 else 1
+        if TABLES[table][2]:
+            point_type = 'bool'
+        else:
+            point_type = 'int16' if signed else 'uint16'
+        for offset in range(count):
+            points.append({'name': f'{table}:{address + offset}', 'address': address + offset,
+                           'table': table, 'type': point_type})
+    return points
+
+
+class _Writer:
+    """Buffer rows and write them in batches as CSV or line-delimited JSON"""
+
+    def __init__(self, stream, fmt, names, batch, flush_interval):
+        self._stream = stream
+        self._fmt = fmt
+        self._names = names
+        self._batch = batch
+        self._flush_interval = flush_interval
+        self._rows = []
+        self._flushed = time.monotonic()
+        if fmt == 'csv':
+            stream.write(','.join(['timestamp'] + names) + '\n')
+
+    def add(self, timestamp, values):
+        if self._fmt == 'csv':
+            row = [f'{timestamp:.3f}'] + [self._csv_value(values.get(name)) for name in self._names]
+            self._rows.append(','.join(row))
+        else:
+            record = {'timestamp': round(timestamp, 3)}
+            record.update(values)
+            self._rows.append(json.dumps(record))
+        if len(self._rows) >= self._batch or time.monotonic() - self._flushed >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._stream.write('\n'.join(self._rows) + '\n')
+            self._rows.clear()
+        self._stream.flush()
+        self._flushed = time.monotonic()
+
+    def _csv_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return str(int(value))
+        return str(value)
+
+
+def _register_map(args):
+    if args.map:
+        with open(args.map) as stream:
+            if args.map.endswith('.json'):
+                return RegisterMap.from_json(stream)
+            return RegisterMap.from_csv(stream)
+    return RegisterMap(_points(args.points, args.signed))
+
+
+def _read(args):
+    register_map = args.register_map
+    client = _client(args)
+    values = register_map.read(client)
+    writer = _Writer(args.output, args.format, [point.name for point in register_map.points], 1, 0)
+    writer.add(time.time(), values)
+    writer.flush()
+
+
+def _write(args):
+    client = _client(args)
+    values = args.values
+    if args.table == 'coil':
+        if len(values) == 1:
+            ok = client.write_single_coil(args.address, values[0])
+        else:
+            ok = client.write_multiple_coils(args.address, values)
+    else:
+        if len(values) == 1:
+            ok = client.write_single_register(args.address, values[0], signed=args.signed)
+        else:
+            ok = client.write_multiple_registers(args.address, values, signed=args.signed)
+    if not ok:
+        sys.exit('write was not confirmed by the server')
+
+
+def _poll(args):
+    register_map = args.register_map
+    plan = register_map.compile()
+    client = _client(args)
+    writer = _Writer(args.output, args.format, [point.name for point in register_map.points],
+                     args.batch, args.flush)
+    period = 1 / args.rate
+    scans = 0
+    errors = 0
+    intervals = []
+    started = time.monotonic()
+    next_scan = started
+    last_scan = None
+    try:
+        while args.duration is None or time.monotonic() - started < args.duration:
+            now = time.monotonic()
+            if now < next_scan:
+                time.sleep(next_scan - now)
+                continue
+            next_scan = _next_slot(next_scan, period, now)
+            if last_scan is not None:
+                intervals.append(now - last_scan)
+            last_scan = now
+            try:
+                values = plan.read(client)
+            except (OSError, ValueError) as e:
+                errors += 1
+                print(f'scan failed: {e}', file=sys.stderr)
+                continue
+            scans += 1
+            writer.add(time.time(), values)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.flush()
+
+    elapsed = time.monotonic() - started
+    summary = f'{scans} scans, {errors} errors in {elapsed:.1f}s, {scans / elapsed if elapsed else 0:.2f} scans/s'
+    if intervals:
+        mean = sum(intervals) / len(intervals)
+        jitter = (sum((interval - mean) ** 2 for interval in intervals) / len(intervals)) ** 0.5
+        summary += f', period {mean * 1000:.1f} ms, jitter {jitter * 1000:.2f} ms, max {max(intervals) * 1000:.1f} ms'
+    print(summary, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m uModBus', description='Modbus TCP/RTU command line client')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('transport', choices=('tcp', 'rtu'))
+    common.add_argument('target', help='server host for tcp, serial device or pty path for rtu')
+    common.add_argument('--port', type=int, default=502)
+    common.add_argument('--baudrate', type=int, default=19200)
+    common.add_argument('--parity', choices=('N', 'E', 'O'), default='N')
+    common.add_argument('--stop-bits', type=int, choices=(1, 2), default=1)
+    common.add_argument('--unit', type=int, default=1)
+    common.add_argument('--timeout', type=float, default=1)
+    common.add_argument('--signed', action='store_true', help='treat registers as signed 16-bit values')
+
+    points = argparse.ArgumentParser(add_help=False)
+    source = points.add_mutually_exclusive_group(required=True)
+    source.add_argument('--points', help='table:address[:count] items, e.g. holding:0:10,coil:0:8')
+    source.add_argument('--map', help='register map file, .json or .csv')
+    points.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    points.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout)
+
+    read = commands.add_parser('read', parents=[common, points], help='read points once')
+    read.set_defaults(handler=_read)
+
+    write = commands.add_parser('write', parents=[common], help='write coils or holding registers')
+    write.add_argument('--table', choices=('coil', 'holding'), default='holding')
+    write.add_argument('--address', type=lambda text: int(text, 0), required=True)
+    write.add_argument('values', nargs='+', type=lambda text: int(text, 0))
+    write.set_defaults(handler=_write)
+
+    poll = commands.add_parser('poll', parents=[common, points], help='poll points at a fixed rate')
+    poll.add_argument('--rate', type=float, default=1, help='scans per second')
+    poll.add_argument('--duration', type=float, default=None, help='seconds to poll, default until interrupted')
+    poll.add_argument('--batch', type=int, default=100, help='rows buffered before writing')
+    poll.add_argument('--flush', type=float, default=1, help='maximum seconds between writes')
+    poll.set_defaults(handler=_poll)
+
+    args = parser.parse_args(argv)
+    if args.command != 'write':
+        try:
+            args.register_map = _register_map(args)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            parser.error(f'invalid points: {e}')
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
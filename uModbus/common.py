@@ -1,4 +1,5 @@
 import struct
+import time
 import uModBus.const as Const
 import uModBus.functions as functions
 
@@ -53,8 +54,9 @@ class Client:
             unit = self._default_unit_id
             
         response = self._send_receive(unit, modbus_pdu, False)
-        operation_status = functions.validate_resp_data(response, Const.WRITE_SINGLE_COIL,
-                                                        output_address, value=output_value, signed=False)
+        # the server echoes the encoded value, 0xFF00 for on
+        operation_status = functions.validate_resp_data(response, Const.WRITE_SINGLE_COIL, output_address,
+                                                        value=0xFF00 if output_value else 0x0000, signed=False)
 
         return operation_status
 
@@ -92,6 +94,159 @@ class Client:
 
         return operation_status
 
+    def read_file_record(self, sub_requests, *, unit=None, signed=True):
+        """Read (file_number, record_number, record_length) sub-requests using as few requests as possible"""
+        if unit is None:
+            unit = self._default_unit_id
+
+        # long sub-requests are split so that every response fits in a PDU
+        max_length = (Const.MAX_READ_FILE_BYTES - 2) // 2
+        chunks = []
+        for index, (file_number, record_number, record_length) in enumerate(sub_requests):
+            while record_length > 0:
+                length = min(record_length, max_length)
+                chunks.append((index, file_number, record_number, length))
+                record_number += length
+                record_length -= length
+
+        records = [[] for _ in sub_requests]
+        for batch in _pack_batches(chunks, lambda chunk: 2 + chunk[3] * 2, Const.MAX_READ_FILE_BYTES,
+                                   Const.MAX_READ_FILE_BYTES // 7):
+            modbus_pdu = functions.read_file_record([chunk[1:] for chunk in batch])
+            response = self._send_receive(unit, modbus_pdu, True)
+            offset = 0
+            for chunk in batch:
+                length = response[offset]
+                if response[offset + 1] != Const.FILE_REFERENCE_TYPE or length != 1 + chunk[3] * 2:
+                    raise ValueError('invalid file record response')
+                records[chunk[0]].extend(self._to_short(response[offset + 2:offset + 1 + length], signed))
+                offset += 1 + length
+
+        return records
+
+    def write_file_record(self, sub_requests, *, unit=None, signed=True):
+        """Write (file_number, record_number, values) sub-requests using as few requests as possible"""
+        if unit is None:
+            unit = self._default_unit_id
+
+        max_length = (Const.MAX_WRITE_FILE_BYTES - 7) // 2
+        chunks = []
+        for file_number, record_number, values in sub_requests:
+            for start in range(0, len(values), max_length):
+                chunks.append((file_number, record_number + start, values[start:start + max_length]))
+
+        operation_status = True
+        for batch in _pack_batches(chunks, lambda chunk: 7 + len(chunk[2]) * 2, Const.MAX_WRITE_FILE_BYTES):
+            modbus_pdu = functions.write_file_record(batch, signed)
+            response = self._send_receive(unit, modbus_pdu, True)
+            operation_status = operation_status and bytes(response) == modbus_pdu[2:]
+
+        return operation_status
+
+    def read_fifo_queue(self, fifo_pointer_address, *, unit=None, signed=True):
+        modbus_pdu = functions.read_fifo_queue(fifo_pointer_address)
+        if unit is None:
+            unit = self._default_unit_id
+
+        response = self._send_receive(unit, modbus_pdu, False)
+        fifo_count = struct.unpack_from('>H', response, 2)[0]
+
+        return self._to_short(response[4:4 + fifo_count * 2], signed)
+
+    def read_exception_status(self, *, unit=None):
+        """Return the eight exception status outputs of the server as an integer"""
+        modbus_pdu = functions.read_exception_status()
+        if unit is None:
+            unit = self._default_unit_id
+
+        response = self._send_receive(unit, modbus_pdu, False)
+
+        return response[0]
+
+    def diagnostics(self, sub_function, data=0, *, unit=None):
+        """Run a diagnostics sub-function and return the data word of the response"""
+        modbus_pdu = functions.diagnostics(sub_function, data)
+        if unit is None:
+            unit = self._default_unit_id
+
+        response = self._send_receive(unit, modbus_pdu, False)
+        resp_sub_function, resp_data = struct.unpack('>HH', response)
+        if resp_sub_function != sub_function:
+            raise ValueError(f'diagnostics sub-function {sub_function} answered with {resp_sub_function}')
+
+        return resp_data
+
+    def restart_communications(self, clear_log=False, *, unit=None):
+        return self.diagnostics(Const.RESTART_COMMUNICATIONS, 0xFF00 if clear_log else 0x0000, unit=unit)
+
+    def clear_counters(self, *, unit=None):
+        return self.diagnostics(Const.CLEAR_COUNTERS, unit=unit)
+
+    def diagnostic_counters(self, *, unit=None):
+        """Return the bus and server counters of the server as a dict"""
+        return {name: self.diagnostics(sub_function, unit=unit) for sub_function, name in _DIAGNOSTIC_COUNTERS.items()}
+
+    def get_com_event_counter(self, *, unit=None):
+        """Return (status, event count), status is 0xFFFF while the server is busy"""
+        modbus_pdu = functions.get_com_event_counter()
+        if unit is None:
+            unit = self._default_unit_id
+
+        response = self._send_receive(unit, modbus_pdu, False)
+
+        return struct.unpack('>HH', response)
+
+    def get_com_event_log(self, *, unit=None):
+        """Return (status, event count, message count, events), events are bytes, most recent first"""
+        modbus_pdu = functions.get_com_event_log()
+        if unit is None:
+            unit = self._default_unit_id
+
+        response = self._send_receive(unit, modbus_pdu, True)
+        status, event_count, message_count = struct.unpack_from('>HHH', response)
+
+        return status, event_count, message_count, bytes(response[6:])
+
+    def report_server_id(self, *, unit=None):
+        """Return the device specific server id data, uModBus servers send the id followed by the run indicator"""
+        modbus_pdu = functions.report_server_id()
+        if unit is None:
+            unit = self._default_unit_id
+
+        response = self._send_receive(unit, modbus_pdu, True)
+
+        return bytes(response)
+
+    def read_device_identification(self, read_code=Const.READ_DEVICE_ID_BASIC, object_id=0, *, unit=None):
+        """Return a dict of object id -> bytes, following "more follows" until the whole category is read"""
+        if unit is None:
+            unit = self._default_unit_id
+
+        objects = {}
+        while True:
+            modbus_pdu = functions.read_device_identification(read_code, object_id)
+            response = self._send_receive(unit, modbus_pdu, False)
+            mei_type, _, _, more_follows, next_object_id, object_count = struct.unpack_from('>BBBBBB', response)
+            if mei_type != Const.MEI_READ_DEVICE_ID:
+                raise ValueError(f'invalid MEI type {mei_type}')
+
+            offset = 6
+            for _ in range(object_count):
+                length = response[offset + 1]
+                objects[response[offset]] = bytes(response[offset + 2:offset + 2 + length])
+                offset += 2 + length
+
+            if not more_follows or read_code == Const.READ_DEVICE_ID_SPECIFIC:
+                return objects
+            if next_object_id <= object_id:
+                raise ValueError('device identification continuation does not advance')
+            object_id = next_object_id
+
+    def subscribe(self, table, starting_address, quantity, **kwargs):
+        """Return a Subscription reporting only the changed values of a coil or register range"""
+        from uModBus.subscribe import Subscription
+        return Subscription(self, table, starting_address, quantity, **kwargs)
+
     def _bytes_to_bool(self, byte_list):
         bool_list = []
         for index, byte in enumerate(byte_list):
@@ -105,10 +260,154 @@ class Client:
 
         return struct.unpack(fmt, byte_array)
 
+def _pack_batches(items, cost, limit, max_items=None):
+    batch = []
+    size = 0
+    for item in items:
+        item_cost = cost(item)
+        if batch and (size + item_cost > limit or len(batch) == max_items):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(item)
+        size += item_cost
+    if batch:
+        yield batch
+
+def _next_slot(scheduled, period, now):
+    """Return the start of the first slot of a fixed rate schedule after now, skipping missed slots instead of bursting to catch up"""
+    return scheduled + period * (int((now - scheduled) / period) + 1)
+
+def _bucket_size(rate, burst):
+    """Return burst, defaulting to a bucket of at least one token for a rate limit"""
+    if burst is None and rate is not None:
+        # a bucket smaller than one token would never allow anything
+        return max(1, rate)
+    return burst
+
+class _TokenBucket:
+    """Rate limit state; rate and burst are passed on every call so changes to them apply at once"""
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.refilled = time.monotonic()
+
+    def refill(self, rate, burst):
+        """Add the tokens earned since the last refill, returning if a whole token is available"""
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.refilled) * rate)
+        self.refilled = now
+        return self.tokens >= 1
+
+    def take(self, rate, burst):
+        """Use a token if one is available, returning if it was"""
+        if not self.refill(rate, burst):
+            return False
+        self.tokens -= 1
+        return True
+
+_READ_FUNCTIONS = (Const.READ_COILS, Const.READ_DISCRETE_INPUTS, Const.READ_HOLDING_REGISTERS,
+                   Const.READ_INPUT_REGISTER, Const.READ_FILE_RECORD, Const.READ_FIFO_QUEUE,
+                   Const.READ_EXCEPTION_STATUS, Const.DIAGNOSTICS, Const.GET_COM_EVENT_COUNTER,
+                   Const.GET_COM_EVENT_LOG, Const.REPORT_SERVER_ID, Const.READ_DEVICE_IDENTIFICATION)
+
+# read device code -> highest object id of the category
+_DEVICE_ID_CATEGORIES = {
+    Const.READ_DEVICE_ID_BASIC: Const.MAJOR_MINOR_REVISION,
+    Const.READ_DEVICE_ID_REGULAR: 0x7F,
+    Const.READ_DEVICE_ID_EXTENDED: 0xFF,
+}
+
+_COIL_FUNCTIONS = (Const.READ_COILS, Const.WRITE_SINGLE_COIL, Const.WRITE_MULTIPLE_COILS)
+
+# function codes whose request starts with an address and a quantity or value
+_ADDRESSED_FUNCTIONS = (Const.READ_COILS, Const.READ_DISCRETE_INPUTS, Const.READ_HOLDING_REGISTERS,
+                        Const.READ_INPUT_REGISTER, Const.WRITE_SINGLE_COIL, Const.WRITE_SINGLE_REGISTER,
+                        Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS)
+
+# diagnostics sub-function -> DiagnosticCounters attribute
+_DIAGNOSTIC_COUNTERS = {
+    Const.RETURN_BUS_MESSAGE_COUNT: 'bus_messages',
+    Const.RETURN_BUS_COMMUNICATION_ERROR_COUNT: 'bus_errors',
+    Const.RETURN_BUS_EXCEPTION_ERROR_COUNT: 'bus_exceptions',
+    Const.RETURN_SERVER_MESSAGE_COUNT: 'server_messages',
+    Const.RETURN_SERVER_NO_RESPONSE_COUNT: 'no_response',
+    Const.RETURN_SERVER_NAK_COUNT: 'nak',
+    Const.RETURN_SERVER_BUSY_COUNT: 'busy',
+    Const.RETURN_BUS_CHARACTER_OVERRUN_COUNT: 'overruns',
+}
+
+# diagnostics sub-functions that change the state of the server
+_DIAGNOSTIC_CONTROLS = (Const.RESTART_COMMUNICATIONS, Const.FORCE_LISTEN_ONLY,
+                        Const.CLEAR_COUNTERS, Const.CLEAR_OVERRUN_COUNTER)
+
+
+class DiagnosticCounters:
+    """Standard Modbus bus and server counters, reported through the diagnostics function codes"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.bus_messages = 0
+        self.bus_errors = 0
+        self.bus_exceptions = 0
+        self.server_messages = 0
+        self.no_response = 0
+        self.nak = 0
+        self.busy = 0
+        self.overruns = 0
+        # successfully completed requests, reported by GET_COM_EVENT_COUNTER
+        self.events = 0
+
 class Server:
+    # bytes of transport header in front of the PDU in the response buffer
+    _pdu_offset = 0
+
     def __init__(self, unit_addr=None, *, number_coils=None, number_discrete_inputs=None,
-    number_input_registers=None, number_holding_registers=None):
+    number_input_registers=None, number_holding_registers=None, file_records=None, fifo_queues=None, policy=None):
         self.unit_addr = unit_addr 
+        self.policy = policy
+        # address of the client that sent the request being handled, None on serial links
+        self.client_address = None
+        # unit id of the request being handled, echoed by exception responses
+        self._request_unit = 255 if unit_addr is None else unit_addr
+
+        # diagnostics, exception_status, diagnostic_register, server_id and run_indicator are set by the application
+        self.counters = DiagnosticCounters()
+        self.exception_status = 0
+        self.diagnostic_register = 0
+        self.server_id = b'uModBus'
+        self.run_indicator = True
+        self.listen_only = False
+        self._event_log = bytearray(Const.MAX_EVENT_LOG)
+        self._event_next = 0
+        self._event_size = 0
+
+        # responses are encoded in place behind the transport header, see _pdu_buffer
+        self._adu = bytearray(Const.MAX_TCP_ADU_LENGTH)
+        self._adu_view = memoryview(self._adu)
+        self._pdu_views = [None] * (Const.MAX_MSG_LENGTH + 1)
+        self._adu_views = [None] * (Const.MAX_TCP_ADU_LENGTH + 1)
+
+        # object id -> str or bytes, answered by READ_DEVICE_IDENTIFICATION
+        self.device_identification = {
+            Const.VENDOR_NAME: 'FACTS Engineering',
+            Const.PRODUCT_CODE: 'uModBus',
+            Const.MAJOR_MINOR_REVISION: '',
+        }
+
+        # file number -> record count
+        self.file_records = {}
+        if file_records is not None:
+            for file_number, record_count in file_records.items():
+                self.file_records[file_number] = _ValueRegisters(record_count)
+
+        # FIFO pointer address -> list of queued register values
+        self.fifo_queues = {}
+        if fifo_queues is not None:
+            for address in fifo_queues:
+                self.fifo_queues[address] = []
 
         if number_coils is not None:
             self.coils = [0] * number_coils
@@ -124,77 +423,175 @@ class Server:
 
        
     def handle_request(self, data):
+        counters = self.counters
+        counters.bus_messages += 1
         unit_addr = data[0]
         if self.unit_addr is not None and self.unit_addr != unit_addr:
-            print(f"Unit address {unit_addr} does not match {self.unit_addr}")
             return
+        counters.server_messages += 1
+        self._request_unit = unit_addr
+
+        function_code = data[1]
+        # requests without data (FC07, 0B, 0C, 11) have no address field
+        address = (data[2] << 8) | data[3] if len(data) >= 4 else None
+        # set by the branches that encode their response in place
+        pdu_length = 0
+
+        if self.listen_only and not (function_code == Const.DIAGNOSTICS and address == Const.RESTART_COMMUNICATIONS):
+            counters.no_response += 1
+            self._log_event(Const.EVENT_RECEIVE | Const.EVENT_RECEIVE_LISTEN_ONLY)
+            return
+        self._log_event(Const.EVENT_RECEIVE)
 
-        function_code, address = struct.unpack_from('>BH', data, 1)
+        # unit id, function code, address and quantity or value
+        if len(data) < 6 and function_code in _ADDRESSED_FUNCTIONS:
+            self.send_exception(function_code, Const.ILLEGAL_DATA_VALUE)
+            return
 
-        if function_code in [Const.READ_COILS, Const.READ_DISCRETE_INPUTS]:
-            quantity = struct.unpack_from('>H', data, 4)[0]
+        if self.policy is not None and function_code in _READ_FUNCTIONS:
+            exception_code = self.policy.check_read(unit_addr, self.client_address)
+            if exception_code:
+                self.send_exception(function_code, exception_code)
+                return
+
+        if function_code == Const.READ_COILS or function_code == Const.READ_DISCRETE_INPUTS:
+            quantity = (data[4] << 8) | data[5]
             if not self._within_limits(function_code, quantity, address):
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
                 return
-            if function_code == Const.READ_COILS:
-                data = self.coils[address:address+quantity]
-            else:
-                data = self.discrete_inputs[address:address+quantity]
+            bits = self.coils if function_code == Const.READ_COILS else self.discrete_inputs
+            pdu_length = self._encode_bits(function_code, bits, address, quantity)
 
-        elif function_code in [Const.READ_HOLDING_REGISTERS, Const.READ_INPUT_REGISTER]:
-            quantity = struct.unpack_from('>H', data, 4)[0]
+        elif function_code == Const.READ_HOLDING_REGISTERS or function_code == Const.READ_INPUT_REGISTER:
+            quantity = (data[4] << 8) | data[5]
             if not self._within_limits(function_code, quantity, address):
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
                 return
-
             if function_code == Const.READ_HOLDING_REGISTERS:
-                data = self.holding_registers.raw[address:address+quantity]
+                registers = self.holding_registers
             else:
-                data = self.input_registers.raw[address:address+quantity]
-            data = b''.join(data)
+                registers = self.input_registers
+            pdu_length = self._encode_registers(function_code, registers, address, quantity)
 
         elif function_code == Const.WRITE_SINGLE_COIL:
             quantity = None
-            data = data[4:6]
             if not self._within_limits(function_code, quantity, address):
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
                 return
             # allowed values: 0x0000 or 0xFF00
-            if (data[0] not in [0x00, 0xFF]) or data[1] != 0x00:
+            if (data[4] != 0x00 and data[4] != 0xFF) or data[5] != 0x00:
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
                 return
-            self.coils[address] = data[0] & 1
+            if self._write_refused(function_code, unit_addr, 'coils', address, 1):
+                return
+            self.coils[address] = data[4] & 1
+            pdu_length = self._encode_echo(data)
 
         elif function_code == Const.WRITE_SINGLE_REGISTER:
             quantity = None
-            data = data[4:6]
             if not self._within_limits(function_code, quantity, address):
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
                 return
-            self.holding_registers.raw[address] = data
+            if self._write_refused(function_code, unit_addr, 'holding_registers', address, 1):
+                return
+            self.holding_registers.raw[address] = bytes(data[4:6])
             # all values allowed
+            pdu_length = self._encode_echo(data)
 
         elif function_code == Const.WRITE_MULTIPLE_COILS:
-            quantity = struct.unpack_from('>H', data, 4)[0]
+            quantity = (data[4] << 8) | data[5]
             if not self._within_limits(function_code, quantity, address):
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
-                raise ModbusException(function_code, Const.ILLEGAL_DATA_VALUE, self)
-            data = data[7:]
-            if len(data) != ((quantity - 1) // 8) + 1:
-                self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
-                raise ModbusException(function_code, Const.ILLEGAL_DATA_VALUE, self)
-            self.coils[address:address+quantity] = self.data_as_bits(data, quantity)
+                return
+            if len(data) - 7 != ((quantity - 1) // 8) + 1:
+                self.send_exception(function_code, Const.ILLEGAL_DATA_VALUE)
+                return
+            if self._write_refused(function_code, unit_addr, 'coils', address, quantity):
+                return
+            coils = self.coils
+            for index in range(quantity):
+                coils[address + index] = (data[7 + (index >> 3)] >> (index & 7)) & 1
+            pdu_length = self._encode_echo(data)
 
         elif function_code == Const.WRITE_MULTIPLE_REGISTERS:
-            quantity = struct.unpack_from('>H', data, 4)[0]
+            quantity = (data[4] << 8) | data[5]
             if not self._within_limits(function_code, quantity, address):
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
                 return
-            data = data[7:]
-            if len(data) != quantity * 2:
+            if len(data) - 7 != quantity * 2:
+                self.send_exception(function_code, Const.ILLEGAL_DATA_VALUE)
+                return
+            if self._write_refused(function_code, unit_addr, 'holding_registers', address, quantity):
+                return
+            raw = self.holding_registers.raw
+            for index in range(quantity):
+                raw[address + index] = bytes(data[7 + index * 2:9 + index * 2])
+            pdu_length = self._encode_echo(data)
+
+        elif function_code == Const.READ_FILE_RECORD:
+            quantity = None
+            exception_code, address, data = self._read_file_record(data)
+            if exception_code:
+                self.send_exception(function_code, exception_code)
+                return
+
+        elif function_code == Const.WRITE_FILE_RECORD:
+            quantity = None
+            if self._write_refused(function_code, unit_addr, None, 0, 1):
+                return
+            exception_code, address, data = self._write_file_record(data)
+            if exception_code:
+                self.send_exception(function_code, exception_code)
+                return
+
+        elif function_code == Const.READ_FIFO_QUEUE:
+            if address is None:
+                self.send_exception(function_code, Const.ILLEGAL_DATA_VALUE)
+                return
+            queue = self.fifo_queues.get(address)
+            if queue is None:
                 self.send_exception(function_code, Const.ILLEGAL_DATA_ADDRESS)
-                raise ModbusException(function_code, Const.ILLEGAL_DATA_VALUE, self)
-            self.holding_registers.raw[address:address+quantity] = [data[i:i+2] for i in range(0, quantity*2, 2)]
+                return
+            quantity = len(queue)
+            if quantity > Const.MAX_FIFO_COUNT:
+                self.send_exception(function_code, Const.ILLEGAL_DATA_VALUE)
+                return
+            data = struct.pack('>' + 'H' * quantity, *[value & 0xFFFF for value in queue])
+
+        elif function_code == Const.READ_EXCEPTION_STATUS:
+            quantity = None
+            data = bytes((self.exception_status & 0xFF,))
+
+        elif function_code == Const.DIAGNOSTICS:
+            quantity = None
+            if address in _DIAGNOSTIC_CONTROLS and self._write_refused(function_code, unit_addr, None, 0, 1):
+                return
+            exception_code, data = self._diagnostics(data)
+            if exception_code:
+                self.send_exception(function_code, exception_code)
+                return
+            if data is None:
+                # listen only mode was entered or left, neither is answered
+                return
+
+        elif function_code == Const.GET_COM_EVENT_COUNTER:
+            quantity = None
+            data = struct.pack('>HH', 0, counters.events & 0xFFFF)
+
+        elif function_code == Const.GET_COM_EVENT_LOG:
+            quantity = None
+            data = struct.pack('>HHH', 0, counters.events & 0xFFFF, counters.bus_messages & 0xFFFF) + self._event_log_bytes()
+
+        elif function_code == Const.REPORT_SERVER_ID:
+            quantity = None
+            data = self.server_id + (b'\xff' if self.run_indicator else b'\x00')
+
+        elif function_code == Const.READ_DEVICE_IDENTIFICATION:
+            quantity = None
+            exception_code, data = self._read_device_identification(data)
+            if exception_code:
+                self.send_exception(function_code, exception_code)
+                return
 
         else:
             # Not implemented functions
@@ -203,25 +600,287 @@ class Server:
             self.send_exception(function_code, Const.ILLEGAL_FUNCTION)
             return
  
-        self.send_response(unit_addr, function_code, address, quantity, data, data)
+        if pdu_length:
+            self._log_event(Const.EVENT_SEND)
+            self._send(self._pdu_buffer(pdu_length), unit_addr)
+        else:
+            self.send_response(unit_addr, function_code, address, quantity, data, data)
+        if function_code != Const.GET_COM_EVENT_COUNTER and function_code != Const.GET_COM_EVENT_LOG:
+            counters.events += 1
 
         return (function_code, address, quantity)
 
     def send_response(self, slave_addr, function_code, request_register_addr, request_register_qty, request_data, values=None, signed=False):
         modbus_pdu = functions.response(function_code, request_register_addr, request_register_qty, request_data, values, signed)
+        self._log_event(Const.EVENT_SEND)
         self._send(modbus_pdu, slave_addr)
 
     def send_exception_response(self, slave_addr, function_code, exception_code):
-        modbus_pdu = functions.exception_response(function_code, exception_code)
-        self._send(modbus_pdu, slave_addr)
+        offset = self._pdu_offset
+        self._adu[offset] = Const.ERROR_BIAS + function_code
+        self._adu[offset + 1] = exception_code
+        counters = self.counters
+        counters.bus_exceptions += 1
+        event = Const.EVENT_SEND
+        if exception_code <= Const.ILLEGAL_DATA_VALUE:
+            event |= Const.EVENT_SEND_READ_EXCEPTION
+        elif exception_code == Const.SERVER_DEVICE_FAILURE:
+            event |= Const.EVENT_SEND_ABORT_EXCEPTION
+        elif exception_code == Const.ACKNOWLEDGE or exception_code == Const.SERVER_DEVICE_BUSY:
+            event |= Const.EVENT_SEND_BUSY_EXCEPTION
+            if exception_code == Const.SERVER_DEVICE_BUSY:
+                counters.busy += 1
+        elif exception_code == Const.NEGATIVE_ACKNOWLEDGE:
+            event |= Const.EVENT_SEND_NAK_EXCEPTION
+            counters.nak += 1
+        self._log_event(event)
+        self._send(self._pdu_buffer(2), slave_addr)
 
     def send_exception(self, function_code, exception_code):
-        addr = self.unit_addr
-        if addr is None:
-            addr = 255
-        self.send_exception_response(addr, function_code, exception_code)
+        self.send_exception_response(self._request_unit, function_code, exception_code)
 
 
+    def _write_refused(self, function_code, unit_addr, table, address, quantity):
+        if self.policy is None:
+            return False
+        exception_code = self.policy.check_write(table, address, quantity, unit_addr, self.client_address)
+        if exception_code:
+            self.send_exception(function_code, exception_code)
+            return True
+        return False
+
+    def _pdu_buffer(self, length):
+        # views are cached per length so steady state responses create no objects
+        view = self._pdu_views[length]
+        if view is None:
+            view = self._adu_view[self._pdu_offset:self._pdu_offset + length]
+            self._pdu_views[length] = view
+        return view
+
+    def _adu_buffer(self, length):
+        view = self._adu_views[length]
+        if view is None:
+            view = self._adu_view[:length]
+            self._adu_views[length] = view
+        return view
+
+    def _place_pdu(self, modbus_pdu):
+        """Copy modbus_pdu behind the transport header unless it was encoded there, returning its length"""
+        length = len(modbus_pdu)
+        if modbus_pdu is not self._pdu_views[length]:
+            offset = self._pdu_offset
+            self._adu[offset:offset + length] = modbus_pdu
+        return length
+
+    def _encode_bits(self, function_code, bits, address, quantity):
+        adu = self._adu
+        offset = self._pdu_offset
+        byte_count = (quantity + 7) >> 3
+        adu[offset] = function_code
+        adu[offset + 1] = byte_count
+        offset += 2
+        for index in range(offset, offset + byte_count):
+            adu[index] = 0
+        for index in range(quantity):
+            if bits[address + index]:
+                adu[offset + (index >> 3)] |= 1 << (index & 7)
+        return 2 + byte_count
+
+    def _encode_registers(self, function_code, registers, address, quantity):
+        adu = self._adu
+        offset = self._pdu_offset
+        adu[offset] = function_code
+        adu[offset + 1] = quantity * 2
+        offset += 2
+        raw = registers.raw
+        for index in range(address, address + quantity):
+            word = raw[index]
+            adu[offset] = word[0]
+            adu[offset + 1] = word[1]
+            offset += 2
+        return 2 + quantity * 2
+
+    def _encode_echo(self, data):
+        # FC05, 06, 0F and 10 answer with the function code, address and value or quantity of the request
+        adu = self._adu
+        offset = self._pdu_offset
+        for index in range(5):
+            adu[offset + index] = data[1 + index]
+        return 5
+
+    def _log_event(self, event):
+        self._event_log[self._event_next] = event
+        self._event_next = (self._event_next + 1) % Const.MAX_EVENT_LOG
+        if self._event_size < Const.MAX_EVENT_LOG:
+            self._event_size += 1
+
+    def _event_log_bytes(self):
+        # most recent event first
+        log = self._event_log
+        last = self._event_next - 1
+        return bytes(log[(last - i) % Const.MAX_EVENT_LOG] for i in range(self._event_size))
+
+    def _diagnostics(self, data):
+        if len(data) < 6 or len(data) % 2:
+            return Const.ILLEGAL_DATA_VALUE, None
+        sub_function, value = struct.unpack_from('>HH', data, 2)
+        counters = self.counters
+
+        if sub_function == Const.RETURN_QUERY_DATA:
+            return 0, bytes(data[2:])
+
+        if len(data) != 6:
+            return Const.ILLEGAL_DATA_VALUE, None
+
+        if sub_function == Const.RESTART_COMMUNICATIONS:
+            if value not in (0x0000, 0xFF00):
+                return Const.ILLEGAL_DATA_VALUE, None
+            was_listen_only = self.listen_only
+            self.listen_only = False
+            counters.clear()
+            if value:
+                self._event_size = 0
+            self._log_event(Const.EVENT_COMM_RESTART)
+            if was_listen_only:
+                return 0, None
+        elif sub_function == Const.RETURN_DIAGNOSTIC_REGISTER:
+            value = self.diagnostic_register & 0xFFFF
+        elif sub_function == Const.FORCE_LISTEN_ONLY:
+            self.listen_only = True
+            self._log_event(Const.EVENT_LISTEN_ONLY)
+            return 0, None
+        elif sub_function == Const.CLEAR_COUNTERS:
+            counters.clear()
+            self.diagnostic_register = 0
+        elif sub_function == Const.CLEAR_OVERRUN_COUNTER:
+            counters.overruns = 0
+        elif sub_function in _DIAGNOSTIC_COUNTERS:
+            value = getattr(counters, _DIAGNOSTIC_COUNTERS[sub_function]) & 0xFFFF
+        else:
+            return Const.ILLEGAL_FUNCTION, None
+
+        return 0, struct.pack('>HH', sub_function, value)
+
+    def _device_object(self, object_id):
+        value = self.device_identification[object_id]
+        return value.encode() if isinstance(value, str) else value
+
+    def _read_device_identification(self, data):
+        if len(data) < 3 or data[2] != Const.MEI_READ_DEVICE_ID:
+            return Const.ILLEGAL_FUNCTION, None
+        if len(data) != 5:
+            return Const.ILLEGAL_DATA_VALUE, None
+        read_code = data[3]
+        object_id = data[4]
+        objects = self.device_identification
+
+        conformity_level = Const.READ_DEVICE_ID_BASIC
+        for known_id in objects:
+            if known_id > 0x7F:
+                conformity_level = Const.READ_DEVICE_ID_EXTENDED
+                break
+            if known_id > Const.MAJOR_MINOR_REVISION:
+                conformity_level = Const.READ_DEVICE_ID_REGULAR
+        # individual access is always supported
+        conformity_level |= 0x80
+
+        if read_code == Const.READ_DEVICE_ID_SPECIFIC:
+            if object_id not in objects:
+                return Const.ILLEGAL_DATA_ADDRESS, None
+            value = self._device_object(object_id)
+            return 0, struct.pack('>BBBBBBBB', Const.MEI_READ_DEVICE_ID, read_code, conformity_level,
+                                  0, 0, 1, object_id, len(value)) + value
+
+        last_id = _DEVICE_ID_CATEGORIES.get(read_code)
+        if last_id is None:
+            return Const.ILLEGAL_DATA_VALUE, None
+        # streams restart from the first object when asked for one that does not exist
+        if object_id not in objects or object_id > last_id:
+            object_id = 0
+
+        body = bytearray()
+        object_count = 0
+        more_follows = 0
+        next_object_id = 0
+        for known_id in sorted(objects):
+            if known_id < object_id or known_id > last_id:
+                continue
+            value = self._device_object(known_id)
+            # the PDU holds the function code, six header bytes and the objects
+            if 7 + len(body) + 2 + len(value) > Const.MAX_MSG_LENGTH and object_count:
+                more_follows = 0xFF
+                next_object_id = known_id
+                break
+            body.append(known_id)
+            body.append(len(value))
+            body.extend(value)
+            object_count += 1
+
+        return 0, struct.pack('>BBBBBB', Const.MEI_READ_DEVICE_ID, read_code, conformity_level,
+                              more_follows, next_object_id, object_count) + body
+
+    def _file_sub_requests(self, data, data_length, max_length):
+        if len(data) < 3:
+            return None
+        byte_count = data[2]
+        if not (data_length <= byte_count <= max_length) or len(data) < 3 + byte_count:
+            return None
+
+        sub_requests = []
+        offset = 3
+        while offset < 3 + byte_count:
+            if offset + 7 > 3 + byte_count:
+                return None
+            reference_type, file_number, record_number, record_length = struct.unpack_from('>BHHH', data, offset)
+            if reference_type != Const.FILE_REFERENCE_TYPE:
+                return None
+            sub_requests.append((offset + 7, file_number, record_number, record_length))
+            offset += 7
+            if max_length == Const.MAX_WRITE_FILE_BYTES:
+                offset += record_length * 2
+        if offset != 3 + byte_count:
+            return None
+
+        return sub_requests
+
+    def _file_range_valid(self, file_number, record_number, record_length):
+        records = self.file_records.get(file_number)
+        return (records is not None and record_length > 0 and
+                record_number <= Const.MAX_FILE_RECORD_NUMBER and record_number + record_length <= len(records))
+
+    def _read_file_record(self, data):
+        sub_requests = self._file_sub_requests(data, 0x07, Const.MAX_READ_FILE_BYTES)
+        if sub_requests is None:
+            return Const.ILLEGAL_DATA_VALUE, None, None
+
+        response = bytearray()
+        for _, file_number, record_number, record_length in sub_requests:
+            if not self._file_range_valid(file_number, record_number, record_length):
+                return Const.ILLEGAL_DATA_ADDRESS, None, None
+            response.append(1 + record_length * 2)
+            response.append(Const.FILE_REFERENCE_TYPE)
+            response.extend(b''.join(self.file_records[file_number].raw[record_number:record_number + record_length]))
+        if len(response) > Const.MAX_READ_FILE_BYTES:
+            return Const.ILLEGAL_DATA_VALUE, None, None
+
+        return 0, sub_requests[0][1], bytes(response)
+
+    def _write_file_record(self, data):
+        sub_requests = self._file_sub_requests(data, 0x09, Const.MAX_WRITE_FILE_BYTES)
+        if sub_requests is None:
+            return Const.ILLEGAL_DATA_VALUE, None, None
+
+        # validate every sub-request before writing any of them
+        for _, file_number, record_number, record_length in sub_requests:
+            if not self._file_range_valid(file_number, record_number, record_length):
+                return Const.ILLEGAL_DATA_ADDRESS, None, None
+
+        for offset, file_number, record_number, record_length in sub_requests:
+            self.file_records[file_number].raw[record_number:record_number + record_length] = \
+                [bytes(data[i:i+2]) for i in range(offset, offset + record_length * 2, 2)]
+
+        return 0, sub_requests[0][1], bytes(data[2:3 + data[2]])
+
     def data_as_bits(self, data, quantity):
         bits = []
         for byte in data:
@@ -235,7 +894,7 @@ class Server:
         if function_code == Const.READ_DISCRETE_INPUTS:
             object_count = len(self.discrete_inputs)
             quantity_max = 0x07D0
-        elif function_code in [Const.READ_COILS, Const.WRITE_SINGLE_COIL, Const.WRITE_MULTIPLE_COILS]:
+        elif function_code in _COIL_FUNCTIONS:
             object_count = len(self.coils)
             quantity_max = 0x07D0
         elif function_code == Const.READ_INPUT_REGISTER:
@@ -258,12 +917,65 @@ class Server:
 
 
 class ModbusException(Exception):
+    """Raised while handling a request, the transport answers it with one exception response"""
+
     def __init__(self, function_code, exception_code, instance):
-        instance.send_exception_response(instance.unit_addr, function_code, exception_code)
         self.function_code = function_code
         self.exception_code = exception_code
 
 
+class ModbusExceptionResponse(ValueError):
+    """The server answered with an exception response"""
+
+    def __init__(self, function_code, exception_code, unit=None):
+        super().__init__()
+        self.function_code = function_code
+        self.exception_code = exception_code
+        self.unit = unit
+
+    def __str__(self):
+        return f'slave returned exception code: {self.exception_code:d}'
+
+
+class CRCError(OSError):
+    """An RTU frame arrived with a CRC that does not match its contents"""
+
+    def __init__(self, received, expected, frame):
+        super().__init__()
+        self.received = received
+        self.expected = expected
+        self.frame = frame
+
+    def __str__(self):
+        return (f'Bad CRC - received {bytes(self.received).hex()}, expected {bytes(self.expected).hex()}, '
+                f'frame {bytes(self.frame).hex()}')
+
+
+class TransactionMismatch(ValueError):
+    """A response does not belong to the request that was sent"""
+
+    def __init__(self, field, expected, received):
+        super().__init__()
+        self.field = field
+        self.expected = expected
+        self.received = received
+
+    def __str__(self):
+        return f'wrong {self.field}: expected {self.expected}, received {self.received}'
+
+
+class Timeout(TimeoutError):
+    """No response was received from the server"""
+
+    def __init__(self, unit=None, function_code=None):
+        super().__init__()
+        self.unit = unit
+        self.function_code = function_code
+
+    def __str__(self):
+        return f'no response received from unit {self.unit}'
+
+
 class _ValueRegisters():
     def __init__(self, length):
         self.raw = [bytes(2)] * length
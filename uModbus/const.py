@@ -35,6 +35,50 @@ GET_COM_EVENT_LOG = 0x0C
 REPORT_SERVER_ID = 0x11
 READ_DEVICE_IDENTIFICATION = 0x2B
 
+# diagnostics sub-function codes
+RETURN_QUERY_DATA = 0x00
+RESTART_COMMUNICATIONS = 0x01
+RETURN_DIAGNOSTIC_REGISTER = 0x02
+FORCE_LISTEN_ONLY = 0x04
+CLEAR_COUNTERS = 0x0A
+RETURN_BUS_MESSAGE_COUNT = 0x0B
+RETURN_BUS_COMMUNICATION_ERROR_COUNT = 0x0C
+RETURN_BUS_EXCEPTION_ERROR_COUNT = 0x0D
+RETURN_SERVER_MESSAGE_COUNT = 0x0E
+RETURN_SERVER_NO_RESPONSE_COUNT = 0x0F
+RETURN_SERVER_NAK_COUNT = 0x10
+RETURN_SERVER_BUSY_COUNT = 0x11
+RETURN_BUS_CHARACTER_OVERRUN_COUNT = 0x12
+CLEAR_OVERRUN_COUNTER = 0x14
+
+# communication event log entries
+EVENT_RECEIVE = 0x80
+EVENT_RECEIVE_COMM_ERROR = 0x02
+EVENT_RECEIVE_OVERRUN = 0x10
+EVENT_RECEIVE_LISTEN_ONLY = 0x20
+EVENT_SEND = 0x40
+EVENT_SEND_READ_EXCEPTION = 0x01
+EVENT_SEND_ABORT_EXCEPTION = 0x02
+EVENT_SEND_BUSY_EXCEPTION = 0x04
+EVENT_SEND_NAK_EXCEPTION = 0x08
+EVENT_LISTEN_ONLY = 0x04
+EVENT_COMM_RESTART = 0x00
+MAX_EVENT_LOG = 64
+
+# read device identification
+MEI_READ_DEVICE_ID = 0x0E
+READ_DEVICE_ID_BASIC = 0x01
+READ_DEVICE_ID_REGULAR = 0x02
+READ_DEVICE_ID_EXTENDED = 0x03
+READ_DEVICE_ID_SPECIFIC = 0x04
+VENDOR_NAME = 0x00
+PRODUCT_CODE = 0x01
+MAJOR_MINOR_REVISION = 0x02
+VENDOR_URL = 0x03
+PRODUCT_NAME = 0x04
+MODEL_NAME = 0x05
+USER_APPLICATION_NAME = 0x06
+
 # exception codes
 ILLEGAL_FUNCTION = 0x01
 ILLEGAL_DATA_ADDRESS = 0x02
@@ -42,6 +86,7 @@ ILLEGAL_DATA_VALUE = 0x03
 SERVER_DEVICE_FAILURE = 0x04
 ACKNOWLEDGE = 0x05
 SERVER_DEVICE_BUSY = 0x06
+NEGATIVE_ACKNOWLEDGE = 0x07
 MEMORY_PARITY_ERROR = 0x08
 GATEWAY_PATH_UNAVAILABLE = 0x0A
 DEVICE_FAILED_TO_RESPOND = 0x0B
@@ -52,53 +97,16 @@ ERROR_BIAS = 0x80
 RESPONSE_HDR_LENGTH = 0x02
 ERROR_RESP_LEN = 0x05
 FIXED_RESP_LEN = 0x08
+MIN_RTU_FRAME_LEN = 0x04
 MBAP_HDR_LENGTH = 0x07
+FILE_REFERENCE_TYPE = 0x06
+MAX_FILE_RECORD_NUMBER = 0x270F
+MAX_READ_FILE_BYTES = 0xF5
+MAX_WRITE_FILE_BYTES = 0xFB
+MAX_FIFO_COUNT = 31
 
 MAX_MSG_LENGTH = 253
-
-CRC16_TABLE = (
-    0x0000,0xC0C1,0xC181,0x0140,0xC301,0x03C0,0x0280,0xC241,0xC601,
-    0x06C0,0x0780,0xC741,0x0500,0xC5C1,0xC481,0x0440,0xCC01,0x0CC0,
-    0x0D80,0xCD41,0x0F00,0xCFC1,0xCE81,0x0E40,0x0A00,0xCAC1,0xCB81,
-    0x0B40,0xC901,0x09C0,0x0880,0xC841,0xD801,0x18C0,0x1980,0xD941,
-    0x1B00,0xDBC1,0xDA81,0x1A40,0x1E00,0xDEC1,0xDF81,0x1F40,0xDD01,
-    0x1DC0,0x1C80,0xDC41,0x1400,0xD4C1,0xD581,0x1540,0xD701,0x17C0,
-    0x1680,0xD641,0xD201,0x12C0,0x1380,0xD341,0x1100,0xD1C1,0xD081,
-    0x1040,0xF001,0x30C0,0x3180,0xF141,0x3300,0xF3C1,0xF281,0x3240,
-    0x3600,0xF6C1,0xF781,0x3740,0xF501,0x35C0,0x3480,0xF441,0x3C00,
-    0xFCC1,0xFD81,0x3D40,0xFF01,0x3FC0,0x3E80,0xFE41,0xFA01,0x3AC0,
-    0x3B80,0xFB41,0x3900,0xF9C1,0xF881,0x3840,0x2800,0xE8C1,0xE981,
-    0x2940,0xEB01,0x2BC0,0x2A80,0xEA41,0xEE01,0x2EC0,0x2F80,0xEF41,
-    0x2D00,0xEDC1,0xEC81,0x2C40,0xE401,0x24C0,0x2580,0xE541,0x2700,
-    0xE7C1,0xE681,0x2640,0x2200,0xE2C1,0xE381,0x2340,0xE101,0x21C0,
-    0x2080,0xE041,0xA001,0x60C0,0x6180,0xA141,0x6300,0xA3C1,0xA281,
-    0x6240,0x6600,0xA6C1,0xA781,0x6740,0xA501,0x65C0,0x6480,0xA441,
-    0x6C00,0xACC1,0xAD81,0x6D40,0xAF01,0x6FC0,0x6E80,0xAE41,0xAA01,
-    0x6AC0,0x6B80,0xAB41,0x6900,0xA9C1,0xA881,0x6840,0x7800,0xB8C1,
-    0xB981,0x7940,0xBB01,0x7BC0,0x7A80,0xBA41,0xBE01,0x7EC0,0x7F80,
-    0xBF41,0x7D00,0xBDC1,0xBC81,0x7C40,0xB401,0x74C0,0x7580,0xB541,
-    0x7700,0xB7C1,0xB681,0x7640,0x7200,0xB2C1,0xB381,0x7340,0xB101,
-    0x71C0,0x7080,0xB041,0x5000,0x90C1,0x9181,0x5140,0x9301,0x53C0,
-    0x5280,0x9241,0x9601,0x56C0,0x5780,0x9741,0x5500,0x95C1,0x9481,
-    0x5440,0x9C01,0x5CC0,0x5D80,0x9D41,0x5F00,0x9FC1,0x9E81,0x5E40,
-    0x5A00,0x9AC1,0x9B81,0x5B40,0x9901,0x59C0,0x5880,0x9841,0x8801,
-    0x48C0,0x4980,0x8941,0x4B00,0x8BC1,0x8A81,0x4A40,0x4E00,0x8EC1,
-    0x8F81,0x4F40,0x8D01,0x4DC0,0x4C80,0x8C41,0x4400,0x84C1,0x8581,
-    0x4540,0x8701,0x47C0,0x4680,0x8641,0x8201,0x42C0,0x4380,0x8341,
-    0x4100,0x81C1,0x8081,0x4040
-)
-
-""" Code to generate the CRC-16 lookup table:
-def generate_crc16_table():
-    crc_table = []
-    for byte in range(256):
-        crc = 0x0000
-        for _ in range(8):
-            if (byte ^ crc) & 0x0001:
-                crc = (crc >> 1) ^ 0xa001
-            else:
-                crc >>= 1
-            byte >>= 1
-        crc_table.append(crc)
-    return crc_table
-    """
+MAX_TCP_ADU_LENGTH = 260
+MAX_RTU_ADU_LENGTH = 256
+# unit addresses above this are reserved on serial lines
+MAX_UNIT_ADDRESS = 247
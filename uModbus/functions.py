@@ -68,6 +68,54 @@ def write_multiple_registers(starting_address, register_values, signed=True):
     return struct.pack('>BHHB' + fmt, Const.WRITE_MULTIPLE_REGISTERS, starting_address,
                         quantity, quantity * 2, *register_values)
 
+def read_file_record(sub_requests):
+    byte_count = len(sub_requests) * 7
+    if not (0x07 <= byte_count <= Const.MAX_READ_FILE_BYTES):
+        raise ValueError('invalid number of file record sub-requests')
+
+    modbus_pdu = bytearray(struct.pack('>BB', Const.READ_FILE_RECORD, byte_count))
+    for file_number, record_number, record_length in sub_requests:
+        if not (0 <= record_number <= Const.MAX_FILE_RECORD_NUMBER):
+            raise ValueError('invalid record number')
+        modbus_pdu.extend(struct.pack('>BHHH', Const.FILE_REFERENCE_TYPE, file_number, record_number, record_length))
+
+    return bytes(modbus_pdu)
+
+def write_file_record(sub_requests, signed=True):
+    fmt = 'h' if signed else 'H'
+    request_data = bytearray()
+    for file_number, record_number, values in sub_requests:
+        if not (0 <= record_number <= Const.MAX_FILE_RECORD_NUMBER):
+            raise ValueError('invalid record number')
+        request_data.extend(struct.pack('>BHHH' + fmt * len(values), Const.FILE_REFERENCE_TYPE,
+                                        file_number, record_number, len(values), *values))
+
+    if not (0x09 <= len(request_data) <= Const.MAX_WRITE_FILE_BYTES):
+        raise ValueError('invalid file record request length')
+
+    return struct.pack('>BB', Const.WRITE_FILE_RECORD, len(request_data)) + request_data
+
+def read_fifo_queue(fifo_pointer_address):
+    return struct.pack('>BH', Const.READ_FIFO_QUEUE, fifo_pointer_address)
+
+def read_exception_status():
+    return struct.pack('>B', Const.READ_EXCEPTION_STATUS)
+
+def diagnostics(sub_function, data=0):
+    return struct.pack('>BHH', Const.DIAGNOSTICS, sub_function, data)
+
+def get_com_event_counter():
+    return struct.pack('>B', Const.GET_COM_EVENT_COUNTER)
+
+def get_com_event_log():
+    return struct.pack('>B', Const.GET_COM_EVENT_LOG)
+
+def report_server_id():
+    return struct.pack('>B', Const.REPORT_SERVER_ID)
+
+def read_device_identification(read_code, object_id):
+    return struct.pack('>BBBB', Const.READ_DEVICE_IDENTIFICATION, Const.MEI_READ_DEVICE_ID, read_code, object_id)
+
 def validate_resp_data(data, function_code, address, value=None, quantity=None, signed = True):
     if function_code in [Const.WRITE_SINGLE_COIL, Const.WRITE_SINGLE_REGISTER]:
         fmt = '>H' + ('h' if signed else 'H')
@@ -105,5 +153,21 @@ def response(function_code, request_register_addr, request_register_qty, request
     elif function_code in [Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS]:
         return struct.pack('>BHH', function_code, request_register_addr, request_register_qty)
 
+    elif function_code == Const.READ_FILE_RECORD:
+        return struct.pack('>BB', function_code, len(value_list)) + value_list
+
+    elif function_code == Const.WRITE_FILE_RECORD:
+        return struct.pack('>B', function_code) + request_data
+
+    elif function_code == Const.READ_FIFO_QUEUE:
+        return struct.pack('>BHH', function_code, len(value_list) + 2, len(value_list) // 2) + value_list
+
+    elif function_code in [Const.READ_EXCEPTION_STATUS, Const.DIAGNOSTICS, Const.GET_COM_EVENT_COUNTER,
+                           Const.READ_DEVICE_IDENTIFICATION]:
+        return struct.pack('>B', function_code) + value_list
+
+    elif function_code in [Const.GET_COM_EVENT_LOG, Const.REPORT_SERVER_ID]:
+        return struct.pack('>BB', function_code, len(value_list)) + value_list
+
 def exception_response(function_code, exception_code):
     return struct.pack('>BB', Const.ERROR_BIAS + function_code, exception_code)
@@ -0,0 +1,165 @@
+# Fleet scanning with Read Device Identification and a cached device inventory
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+#
+# Serial buses are probed through MultiPortClient, TCP hosts by a thread pool.
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import uModBus.const as Const
+from uModBus.common import ModbusExceptionResponse
+from uModBus.multiport import MultiPortClient
+
+OBJECT_NAMES = {
+    Const.VENDOR_NAME: 'vendor_name',
+    Const.PRODUCT_CODE: 'product_code',
+    Const.MAJOR_MINOR_REVISION: 'revision',
+    Const.VENDOR_URL: 'vendor_url',
+    Const.PRODUCT_NAME: 'product_name',
+    Const.MODEL_NAME: 'model_name',
+    Const.USER_APPLICATION_NAME: 'user_application_name',
+}
+
+
+def _object_names(objects):
+    named = {}
+    for object_id, value in objects.items():
+        named[OBJECT_NAMES.get(object_id, f'0x{object_id:02X}')] = value.decode('utf-8', 'replace')
+    return named
+
+
+class DeviceInventory:
+    """Identities of the devices found by a FleetScanner, keyed by 'location/unit'
+
+    A location is a bus name for serial ports or 'host:port' for TCP. Each
+    record holds the identification objects by name, or None when the device
+    answered but does not support Read Device Identification, and the time
+    it was last seen.
+    """
+
+    def __init__(self, devices=None):
+        self.devices = {} if devices is None else devices
+
+    @staticmethod
+    def key(location, unit):
+        return f'{location}/{unit}'
+
+    def get(self, location, unit):
+        return self.devices.get(self.key(location, unit))
+
+    def add(self, location, unit, objects):
+        self.devices[self.key(location, unit)] = {
+            'location': location,
+            'unit': unit,
+            'objects': None if objects is None else _object_names(objects),
+            'seen': time.time(),
+        }
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, key):
+        return key in self.devices
+
+    def save(self, path):
+        with open(path, 'w') as stream:
+            json.dump(self.devices, stream, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved inventory, or return an empty one if path does not exist"""
+        try:
+            with open(path) as stream:
+                return cls(json.load(stream))
+        except FileNotFoundError:
+            return cls()
+
+
+class FleetScanner:
+    """Discover devices on serial buses and TCP hosts with Read Device Identification
+
+    Buses are scanned in parallel, one worker per bus, with probe_timeout as
+    the response timeout of every probe and retries disabled. TCP hosts are
+    scanned by up to workers threads. Devices already in the inventory are
+    not probed again unless refresh is set.
+    """
+
+    def __init__(self, inventory=None, *, probe_timeout=.05, read_code=Const.READ_DEVICE_ID_BASIC):
+        self.inventory = DeviceInventory() if inventory is None else inventory
+        self.probe_timeout = probe_timeout
+        self.read_code = read_code
+
+    def scan_buses(self, clients, units=range(1, 248), *, refresh=False):
+        """Probe units on every bus, clients maps a bus name to its RTUClient. Returns the keys found"""
+        saved = {}
+        for port, client in clients.items():
+            saved[port] = (dict(client.unit_timeouts), client.retries)
+            client.retries = 0
+            for unit in units:
+                client.unit_timeouts[unit] = self.probe_timeout
+
+        found = []
+        multiport = MultiPortClient(clients)
+        try:
+            for port in clients:
+                for unit in units:
+                    if refresh or self.inventory.get(port, unit) is None:
+                        multiport.submit(port, unit, 'read_device_identification', self.read_code, tag=unit)
+            for result in multiport.results():
+                if self._record(result.port, result.unit, result.value, result.error):
+                    found.append(self.inventory.key(result.port, result.unit))
+        finally:
+            multiport.close()
+            for port, client in clients.items():
+                client.unit_timeouts, client.retries = saved[port]
+
+        return found
+
+    def scan_hosts(self, socket, hosts, units=(255,), *, port=502, timeout=1, workers=16, refresh=False):
+        """Probe units on every TCP host, connecting with timeout seconds. Returns the keys found"""
+        from uModBus.tcp import TCPClient
+
+        def scan(host):
+            location = f'{host}:{port}'
+            pending = [unit for unit in units if refresh or self.inventory.get(location, unit) is None]
+            if not pending:
+                return []
+            try:
+                client = TCPClient(socket, host, server_port=port, timeout=timeout)
+            except OSError:
+                return []
+            found = []
+            try:
+                for unit in pending:
+                    try:
+                        objects = client.read_device_identification(self.read_code, unit=unit)
+                        error = None
+                    except Exception as e:
+                        objects = None
+                        error = e
+                    if self._record(location, unit, objects, error):
+                        found.append(self.inventory.key(location, unit))
+            finally:
+                client._sock.close()
+            return found
+
+        found = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for keys in executor.map(scan, hosts):
+                found.extend(keys)
+
+        return found
+
+    def _record(self, location, unit, objects, error):
+        """Store what a probe learned, returning if a device answered"""
+        if error is None:
+            self.inventory.add(location, unit, objects)
+            return True
+        if isinstance(error, ModbusExceptionResponse):
+            # the device is there but cannot identify itself
+            self.inventory.add(location, unit, None)
+            return True
+        return False
@@ -0,0 +1,250 @@
+# Load generator for qualifying Modbus server deployments
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+#
+# Each TCP connection or serial port is driven by its own thread:
+#
+#   python -m uModBus.loadgen tcp 192.168.1.177 --connections 16 --duration 30
+#   python -m uModBus.loadgen rtu /dev/ttyUSB0 --baudrate 115200 --mix 3:8,16:2
+
+import os
+import random
+import threading
+import time
+import uModBus.const as Const
+from uModBus.common import ModbusExceptionResponse
+
+# function code -> (client method, argument builder(address, quantity, rng))
+OPERATIONS = {
+    Const.READ_COILS: ('read_coils', lambda a, q, rng: (a, q)),
+    Const.READ_DISCRETE_INPUTS: ('read_discrete_inputs', lambda a, q, rng: (a, q)),
+    Const.READ_HOLDING_REGISTERS: ('read_holding_registers', lambda a, q, rng: (a, q)),
+    Const.READ_INPUT_REGISTER: ('read_input_registers', lambda a, q, rng: (a, q)),
+    Const.WRITE_SINGLE_COIL: ('write_single_coil', lambda a, q, rng: (a, rng.getrandbits(1))),
+    Const.WRITE_SINGLE_REGISTER: ('write_single_register', lambda a, q, rng: (a, rng.getrandbits(16))),
+    Const.WRITE_MULTIPLE_COILS: ('write_multiple_coils', lambda a, q, rng: (a, [rng.getrandbits(1) for _ in range(q)])),
+    Const.WRITE_MULTIPLE_REGISTERS: ('write_multiple_registers', lambda a, q, rng: (a, [rng.getrandbits(16) for _ in range(q)])),
+}
+
+_UNSIGNED = (Const.READ_HOLDING_REGISTERS, Const.READ_INPUT_REGISTER,
+             Const.WRITE_SINGLE_REGISTER, Const.WRITE_MULTIPLE_REGISTERS)
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _process_cpu_time(pid):
+    """Return the user + system CPU seconds used by pid, or None if it cannot be read"""
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Report:
+    def __init__(self, elapsed, latencies, counts, exceptions, timeouts, errors, server_cpu):
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+        self.counts = counts
+        self.exceptions = exceptions
+        self.timeouts = timeouts
+        self.errors = errors
+        self.server_cpu = server_cpu
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0
+
+    def percentile(self, pct):
+        return _percentile(self.latencies, pct)
+
+    def __str__(self):
+        lines = [f'{self.requests} requests in {self.elapsed:.2f}s, {self.throughput:.1f} req/s']
+        if self.latencies:
+            lines.append('latency ms: ' + ', '.join(
+                f'p{pct} {self.percentile(pct) * 1000:.2f}' for pct in (50, 90, 99)) +
+                f', max {self.latencies[-1] * 1000:.2f}')
+        lines.append('per function: ' + ', '.join(f'FC{fc:02d} {count}' for fc, count in sorted(self.counts.items())))
+        lines.append(f'exceptions {self.exceptions}, timeouts {self.timeouts}, errors {self.errors}')
+        if self.server_cpu is not None:
+            lines.append(f'server cpu {self.server_cpu * 100:.1f}%')
+        return '\n'.join(lines)
+
+
+class LoadGenerator:
+    """Drive one or more clients with a mix of requests and measure the server's response
+
+    client_factory(index) returns a connected client for worker index. mix maps
+    function codes to relative weights. rate is the total target request rate
+    in requests/s, or None to run flat out.
+    """
+
+    def __init__(self, client_factory, *, connections=1, mix=None, start=0, count=100, quantity=10,
+                 sequential=False, rate=None, unit=None, seed=None, server_pid=None):
+        self.client_factory = client_factory
+        self.connections = connections
+        self.mix = mix or {Const.READ_HOLDING_REGISTERS: 1}
+        for function_code in self.mix:
+            if function_code not in OPERATIONS:
+                raise ValueError(f'unsupported function code {function_code}')
+        self.start = start
+        self.count = count
+        self.quantity = quantity
+        self.sequential = sequential
+        self.rate = rate
+        self.unit = unit
+        self.seed = seed
+        self.server_pid = server_pid
+        self._lock = threading.Lock()
+
+    def run(self, duration):
+        """Generate load for duration seconds and return a Report"""
+        self._latencies = []
+        self._counts = {}
+        self._exceptions = 0
+        self._timeouts = 0
+        self._errors = 0
+        clients = [self.client_factory(index) for index in range(self.connections)]
+
+        cpu_start = _process_cpu_time(self.server_pid) if self.server_pid else None
+        started = time.monotonic()
+        deadline = started + duration
+        workers = [threading.Thread(target=self._worker, args=(index, client, deadline))
+                   for index, client in enumerate(clients)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        server_cpu = None
+        if cpu_start is not None:
+            cpu_end = _process_cpu_time(self.server_pid)
+            if cpu_end is not None:
+                server_cpu = (cpu_end - cpu_start) / elapsed
+
+        return Report(elapsed, self._latencies, self._counts, self._exceptions,
+                      self._timeouts, self._errors, server_cpu)
+
+    def _worker(self, index, client, deadline):
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        function_codes = list(self.mix)
+        weights = [self.mix[function_code] for function_code in function_codes]
+        interval = self.connections / self.rate if self.rate else 0
+        span = max(1, self.count - self.quantity + 1)
+        kwargs = {} if self.unit is None else {'unit': self.unit}
+
+        latencies = []
+        counts = {}
+        exceptions = timeouts = errors = 0
+        next_send = time.monotonic()
+        step = index
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if interval:
+                if now < next_send:
+                    time.sleep(min(next_send - now, deadline - now))
+                    continue
+                next_send += interval
+
+            function_code = rng.choices(function_codes, weights)[0]
+            if self.sequential:
+                address = self.start + (step * self.quantity) % span
+                step += self.connections
+            else:
+                address = self.start + rng.randrange(span)
+            method, build = OPERATIONS[function_code]
+            call_kwargs = dict(kwargs, signed=False) if function_code in _UNSIGNED else kwargs
+
+            stamp = time.monotonic()
+            try:
+                getattr(client, method)(*build(address, self.quantity, rng), **call_kwargs)
+            except ModbusExceptionResponse:
+                exceptions += 1
+                continue
+            except TimeoutError:
+                timeouts += 1
+                continue
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.monotonic() - stamp)
+            counts[function_code] = counts.get(function_code, 0) + 1
+
+        with self._lock:
+            self._latencies.extend(latencies)
+            for function_code, count in counts.items():
+                self._counts[function_code] = self._counts.get(function_code, 0) + count
+            self._exceptions += exceptions
+            self._timeouts += timeouts
+            self._errors += errors
+
+
+def _parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        function_code, _, weight = item.partition(':')
+        mix[int(function_code, 0)] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m uModBus.loadgen', description='Modbus server load generator')
+    parser.add_argument('transport', choices=('tcp', 'rtu'))
+    parser.add_argument('target', help='server host for tcp, serial device or pty path for rtu')
+    parser.add_argument('--port', type=int, default=502)
+    parser.add_argument('--baudrate', type=int, default=19200)
+    parser.add_argument('--unit', type=int, default=1)
+    parser.add_argument('--connections', type=int, default=1, help='concurrent tcp connections')
+    parser.add_argument('--mix', type=_parse_mix, default={Const.READ_HOLDING_REGISTERS: 1},
+                        help='function code weights, e.g. 3:8,16:2')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--count', type=int, default=100, help='size of the address range to exercise')
+    parser.add_argument('--quantity', type=int, default=10)
+    parser.add_argument('--sequential', action='store_true')
+    parser.add_argument('--rate', type=float, default=None, help='total requests/s, default flat out')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=1)
+    parser.add_argument('--server-pid', type=int, default=None, help='local server process to sample cpu from')
+    args = parser.parse_args(argv)
+
+    if args.transport == 'tcp':
+        import socket
+        from uModBus.tcp import TCPClient
+
+        def factory(index):
+            return TCPClient(socket, args.target, server_port=args.port,
+                             default_unit_id=args.unit, timeout=args.timeout)
+    else:
+        if args.connections != 1:
+            parser.error('rtu supports a single connection per serial port')
+        import serial
+        from uModBus.serial import RTUClient
+
+        def factory(index):
+            uart = serial.Serial(args.target, args.baudrate, timeout=0)
+            return RTUClient(uart, default_unit_id=args.unit, timeout=args.timeout, retries=0)
+
+    generator = LoadGenerator(factory, connections=args.connections, mix=args.mix, start=args.start,
+                              count=args.count, quantity=args.quantity, sequential=args.sequential,
+                              rate=args.rate, server_pid=args.server_pid)
+    print(generator.run(args.duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# Passive Modbus RTU bus monitor
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import time
+import struct
+import uModBus.const as Const
+from uModBus.serial import _t35chars_time, _calculate_crc16, _rtu_request_length, _rtu_response_length
+from uModBus.serial import _VARIABLE_LENGTH
+
+CAPTURE_MAGIC = b'MBRTU\x01'
+_RECORD = struct.Struct('<dBH')
+
+FRAME_CRC_OK = 0x01
+FRAME_RESPONSE = 0x02
+FRAME_OVERRUN = 0x04
+
+
+class Frame:
+    def __init__(self, timestamp, data, flags):
+        self.timestamp = timestamp
+        self.data = data
+        self.flags = flags
+
+    @property
+    def valid(self):
+        return bool(self.flags & FRAME_CRC_OK)
+
+    @property
+    def is_response(self):
+        return bool(self.flags & FRAME_RESPONSE)
+
+    @property
+    def unit(self):
+        return self.data[0]
+
+    @property
+    def function_code(self):
+        return self.data[1] & 0x7F if len(self.data) > 1 else None
+
+
+class Exchange:
+    def __init__(self, request, response):
+        self.request = request
+        self.response = response
+
+    @property
+    def unit(self):
+        return self.request.unit
+
+    @property
+    def function_code(self):
+        return self.request.function_code
+
+    @property
+    def exception_code(self):
+        """Return the exception code of an exception response, otherwise None"""
+        if self.response is not None and self.response.data[1] & Const.ERROR_BIAS:
+            return self.response.data[2]
+        return None
+
+    @property
+    def response_time(self):
+        if self.response is None:
+            return None
+        return self.response.timestamp - self.request.timestamp
+
+    @property
+    def address(self):
+        if self.function_code <= Const.WRITE_SINGLE_REGISTER or self.function_code in (
+                Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS):
+            return struct.unpack_from('>H', self.request.data, 2)[0]
+        return None
+
+    @property
+    def quantity(self):
+        if self.function_code <= Const.READ_INPUT_REGISTER or self.function_code in (
+                Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS):
+            return struct.unpack_from('>H', self.request.data, 4)[0]
+        return None
+
+
+class RTUMonitor:
+    """Listen to an RTU bus without transmitting, splitting the traffic into frames
+
+    Frames are delimited by the expected length of the request or response and a
+    valid CRC, or by 3.5 characters of silence when the length cannot be known.
+    When a frame fails its CRC the monitor re-aligns on the next byte that starts
+    a valid frame, reporting the bytes skipped as one bad frame. When capture is a writable binary stream every frame is also recorded to it.
+    """
+
+    def __init__(self, uart, data_bits=8, stop_bits=1, *, buffer_size=1024, capture=None):
+        self._uart = uart
+        self._t35chars = _t35chars_time(self._uart.baudrate, data_bits, stop_bits)
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._length = 0
+        self._frame_start = 0
+        self._last_rx = 0
+        self._pending = None
+        self._ready = []
+        self.capture = capture
+        self.frame_count = 0
+        self.crc_errors = 0
+        self.overruns = 0
+        if capture is not None:
+            capture.write(CAPTURE_MAGIC)
+
+    def read_frame(self):
+        """Return the next frame seen on the bus, or None if no complete frame is available yet"""
+        if not self._ready:
+            self._service()
+        if self._ready:
+            return self._ready.pop(0)
+        return None
+
+    def frames(self, duration=None):
+        """Yield frames as they are seen on the bus, for duration seconds or forever"""
+        start = time.monotonic()
+        while duration is None or time.monotonic() - start < duration:
+            frame = self.read_frame()
+            if frame is not None:
+                yield frame
+
+    def exchanges(self, duration=None):
+        """Yield request/response pairs as they are seen on the bus"""
+        return pair_frames(self.frames(duration))
+
+    def _service(self):
+        waiting = self._uart.in_waiting
+        now = time.monotonic()
+        if waiting:
+            if self._length == 0:
+                self._frame_start = now
+            space = len(self._buf) - self._length
+            if space == 0:
+                self.overruns += 1
+                self._emit(self._length, FRAME_OVERRUN)
+                space = len(self._buf)
+            received = self._uart.readinto(self._view[self._length:self._length + min(waiting, space)])
+            self._length += received or 0
+            self._last_rx = now
+            self._split()
+        elif self._length and now - self._last_rx > self._t35chars:
+            # the silence ends a frame whose length could not be predicted
+            flags = 0
+            if self._length >= Const.MIN_RTU_FRAME_LEN and self._crc_ok(self._view, self._length):
+                flags = FRAME_CRC_OK
+                if self._answers_pending(self._view):
+                    flags |= FRAME_RESPONSE
+            self._emit(self._length, flags)
+
+    def _split(self):
+        skip = 0
+        while self._length - skip >= Const.MIN_RTU_FRAME_LEN:
+            match = self._match(self._view[skip:self._length], skip > 0)
+            if match is None:
+                # wait for more data, or for the silence to delimit the frame
+                return
+            if match is False:
+                # the predicted frame failed its CRC, look for a frame starting one byte later
+                skip += 1
+                continue
+            if skip:
+                self._emit(skip, 0)
+                skip = 0
+            length, flags = match
+            self._emit(length, flags | FRAME_CRC_OK)
+
+    def _match(self, frame, resync):
+        """Return the length and flags of the frame starting at frame[0], None if more
+        data is needed to tell, or False if no valid frame starts there"""
+        if resync and frame[0] > Const.MAX_UNIT_ADDRESS:
+            return False
+        waiting = False
+        for length, flags in self._candidates(frame):
+            if length is None:
+                # unknown function codes are only delimited by silence, never while re-aligning
+                waiting = waiting or not resync or (frame[1] & 0x7F) in _VARIABLE_LENGTH
+            elif length > len(frame):
+                waiting = True
+            elif self._crc_ok(frame, length):
+                return length, flags
+        return None if waiting else False
+
+    def _answers_pending(self, frame):
+        pending = self._pending
+        return pending is not None and frame[0] == pending.data[0] and frame[1] & 0x7F == pending.data[1]
+
+    def _candidates(self, frame):
+        request = (_rtu_request_length(frame), 0)
+        if self._answers_pending(frame):
+            return ((_rtu_response_length(frame), FRAME_RESPONSE), request)
+        return (request,)
+
+    def _crc_ok(self, frame, length):
+        crc = _calculate_crc16(frame[:length - Const.CRC_LENGTH])
+        return crc[0] == frame[length - 2] and crc[1] == frame[length - 1]
+
+    def _emit(self, length, flags):
+        frame = Frame(self._frame_start, bytes(self._view[:length]), flags)
+        if not flags & FRAME_CRC_OK:
+            self.crc_errors += 1
+        elif flags & FRAME_RESPONSE:
+            self._pending = None
+        else:
+            # requests to the broadcast address are never answered
+            self._pending = None if frame.unit == 0 else frame
+
+        self._ready.append(frame)
+        self.frame_count += 1
+        if self.capture is not None:
+            self.capture.write(_RECORD.pack(frame.timestamp, flags, length))
+            self.capture.write(frame.data)
+
+        remaining = self._length - length
+        if remaining:
+            self._view[:remaining] = self._view[length:self._length]
+            self._frame_start = self._last_rx
+        self._length = remaining
+
+
+def pair_frames(frames):
+    """Pair requests with their responses, yielding an Exchange for every request"""
+    pending = None
+    for frame in frames:
+        if frame.is_response:
+            if pending is not None:
+                yield Exchange(pending, frame)
+                pending = None
+            continue
+        if pending is not None:
+            yield Exchange(pending, None)
+            pending = None
+        if frame.valid and len(frame.data) > 1:
+            if frame.unit == 0:
+                yield Exchange(frame, None)
+            else:
+                pending = frame
+    if pending is not None:
+        yield Exchange(pending, None)
+
+
+def read_capture(stream):
+    """Yield the frames recorded in a capture stream"""
+    if stream.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise ValueError('not a Modbus RTU capture')
+    while True:
+        record = stream.read(_RECORD.size)
+        if len(record) < _RECORD.size:
+            return
+        timestamp, flags, length = _RECORD.unpack(record)
+        yield Frame(timestamp, stream.read(length), flags)
@@ -0,0 +1,85 @@
+# Parallel polling of several independent serial buses
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+#
+# Each bus gets its own worker thread, so a slow device only delays its own bus.
+
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+
+
+class Result:
+    def __init__(self, port, unit, method, tag, value=None, error=None):
+        self.port = port
+        self.unit = unit
+        self.method = method
+        self.tag = tag
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class MultiPortClient:
+    """Run requests on several buses in parallel with one worker thread per port
+
+    clients maps a port name to the client driving it, usually an RTUClient.
+    Requests to the same port are executed in order, requests to different
+    ports run concurrently. submit() and results() are meant to be called
+    from a single thread.
+    """
+
+    def __init__(self, clients):
+        self.clients = dict(clients)
+        self._executors = {}
+        for port in self.clients:
+            self._executors[port] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'modbus-{port}')
+        self._results = Queue()
+        self._outstanding = 0
+
+    def submit(self, port, unit, method, *args, tag=None, **kwargs):
+        """Queue client.method(*args, unit=unit, **kwargs) on port and return its Future"""
+        function = getattr(self.clients[port], method)
+        future = self._executors[port].submit(function, *args, unit=unit, **kwargs)
+        self._outstanding += 1
+
+        def done(future):
+            error = future.exception()
+            value = None if error is not None else future.result()
+            self._results.put(Result(port, unit, method, tag, value, error))
+
+        future.add_done_callback(done)
+        return future
+
+    def results(self, timeout=None):
+        """Yield the results of all outstanding requests in completion order
+
+        Stops early if no request completes within timeout seconds.
+        """
+        while self._outstanding:
+            try:
+                result = self._results.get(timeout=timeout)
+            except Empty:
+                return
+            self._outstanding -= 1
+            yield result
+
+    def poll(self, requests, timeout=None):
+        """Submit (port, unit, method, args) requests and yield their results as they complete"""
+        for index, (port, unit, method, args) in enumerate(requests):
+            self.submit(port, unit, method, *args, tag=index)
+        return self.results(timeout)
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
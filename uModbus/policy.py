@@ -0,0 +1,115 @@
+# Request level access control for Modbus servers
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import uModBus.const as Const
+from uModBus.common import _TokenBucket, _bucket_size
+
+
+def _bisect_right(values, value):
+    low = 0
+    high = len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if value < values[middle]:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class _Permission:
+    def __init__(self, read, write, units):
+        self.read = read
+        self.write = write
+        self.units = None if units is None else frozenset(units)
+
+
+class AccessPolicy:
+    """Read-only address ranges, per client permissions and write rate limits for a Server
+
+    Ranges are compiled into sorted interval lists on first use, so each
+    check is a binary search. Clients are identified by IP address on TCP
+    servers and are None on RTU servers. Writes to a read-only range are
+    refused with ILLEGAL_DATA_ADDRESS, requests from clients without
+    permission or over their write rate with SERVER_DEVICE_FAILURE.
+    """
+
+    def __init__(self, *, write_rate=None, write_burst=None):
+        self.write_rate = write_rate
+        self.write_burst = _bucket_size(write_rate, write_burst)
+        self._ranges = {}
+        self._intervals = None
+        self._permissions = {}
+        self._default = _Permission(True, True, None)
+        self._buckets = {}
+
+    def read_only(self, table, start, end=None, *, unit=None):
+        """Protect addresses start to end (inclusive) of 'coils' or 'holding_registers' from writes"""
+        if table not in ('coils', 'holding_registers'):
+            raise ValueError('only coils and holding_registers can be written')
+        if end is None:
+            end = start
+        self._ranges.setdefault((unit, table), []).append((start, end))
+        self._intervals = None
+
+    def allow_client(self, client, *, read=True, write=True, units=None):
+        """Set what a client may do, optionally limited to some unit ids"""
+        self._permissions[client] = _Permission(read, write, units)
+
+    def default_client(self, *, read=True, write=True, units=None):
+        """Set what clients without their own permissions may do"""
+        self._default = _Permission(read, write, units)
+
+    def compile(self):
+        """Merge the read-only ranges into sorted, non overlapping intervals"""
+        self._intervals = {}
+        for key, ranges in self._ranges.items():
+            starts = []
+            ends = []
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._intervals[key] = (starts, ends)
+
+    def check_read(self, unit, client):
+        """Return 0 if the read is allowed, otherwise the exception code to answer with"""
+        permission = self._permissions.get(client, self._default)
+        if not permission.read or (permission.units is not None and unit not in permission.units):
+            return Const.SERVER_DEVICE_FAILURE
+        return 0
+
+    def check_write(self, table, address, quantity, unit, client):
+        """Return 0 if the write is allowed, otherwise the exception code to answer with"""
+        permission = self._permissions.get(client, self._default)
+        if not permission.write or (permission.units is not None and unit not in permission.units):
+            return Const.SERVER_DEVICE_FAILURE
+
+        if table is not None:
+            if self._intervals is None:
+                self.compile()
+            last = address + quantity - 1
+            for key in ((None, table), (unit, table)):
+                intervals = self._intervals.get(key)
+                if intervals is None:
+                    continue
+                starts, ends = intervals
+                index = _bisect_right(starts, last) - 1
+                if index >= 0 and ends[index] >= address:
+                    return Const.ILLEGAL_DATA_ADDRESS
+
+        if self.write_rate is not None and not self._take_token(client):
+            return Const.SERVER_DEVICE_FAILURE
+        return 0
+
+    def _take_token(self, client):
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = _TokenBucket(self.write_burst)
+            self._buckets[client] = bucket
+        return bucket.take(self.write_rate, self.write_burst)
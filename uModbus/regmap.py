@@ -0,0 +1,241 @@
+# Declarative register maps compiled into grouped read plans
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import struct
+import uModBus.functions as functions
+
+# type name -> (struct format, register count)
+TYPES = {
+    'int16': ('h', 1),
+    'uint16': ('H', 1),
+    'int32': ('i', 2),
+    'uint32': ('I', 2),
+    'float32': ('f', 2),
+    'int64': ('q', 4),
+    'uint64': ('Q', 4),
+    'float64': ('d', 4),
+    'bool': (None, 1),
+}
+
+# table name -> (request function, server bank, bit table, maximum quantity per request)
+TABLES = {
+    'coil': (functions.read_coils, 'coils', True, 2000),
+    'discrete': (functions.read_discrete_inputs, 'discrete_inputs', True, 2000),
+    'holding': (functions.read_holding_registers, 'holding_registers', False, 125),
+    'input': (functions.read_input_registers, 'input_registers', False, 125),
+}
+
+_FIELDS = ('name', 'address', 'table', 'type', 'scale', 'offset', 'word_order', 'unit')
+
+
+class Point:
+    def __init__(self, name, address, table='holding', type='uint16', scale=1, offset=0, word_order='big', unit=None):
+        if table not in TABLES:
+            raise ValueError(f'{name}: unknown table {table}')
+        if type not in TYPES:
+            raise ValueError(f'{name}: unknown type {type}')
+        if TABLES[table][2] != (type == 'bool'):
+            raise ValueError(f'{name}: type {type} does not match table {table}')
+        if word_order not in ('big', 'little'):
+            raise ValueError(f'{name}: word order must be big or little')
+        self.name = name
+        self.address = int(address)
+        self.table = table
+        self.type = type
+        self.scale = scale
+        self.offset = offset
+        self.word_order = word_order
+        self.unit = unit
+
+    @property
+    def size(self):
+        return TYPES[self.type][1]
+
+
+class _Block:
+    def __init__(self, unit, table, start, quantity, points):
+        self.unit = unit
+        self.table = table
+        self.start = start
+        self.quantity = quantity
+        self.modbus_pdu = TABLES[table][0](start, quantity)
+        self.bits = TABLES[table][2]
+        # (name, index, scale, offset, word swap unpacker)
+        self.fields = []
+
+        if self.bits:
+            self.struct = None
+            for point in points:
+                bit = point.address - start
+                self.fields.append((point.name, bit >> 3, 1 << (bit & 7), None, None))
+            return
+
+        fmt = '>'
+        index = 0
+        position = start
+        for point in points:
+            fmt += 'x' * ((point.address - position) * 2)
+            code = TYPES[point.type][0]
+            swap = None
+            if point.word_order == 'little' and point.size > 1:
+                # unpack the words individually and reassemble them in reverse order
+                fmt += 'H' * point.size
+                swap = (struct.Struct('>' + code), struct.Struct('>' + 'H' * point.size))
+            else:
+                fmt += code
+            self.fields.append((point.name, index, point.scale, point.offset, swap))
+            index += point.size if swap is not None else 1
+            position = point.address + point.size
+        self.struct = struct.Struct(fmt)
+
+    def decode(self, response, values):
+        if self.bits:
+            for name, byte, mask, _, _ in self.fields:
+                values[name] = bool(response[byte] & mask)
+            return
+
+        raw = self.struct.unpack_from(response)
+        for name, index, scale, offset, swap in self.fields:
+            if swap is None:
+                value = raw[index]
+            else:
+                value_struct, words_struct = swap
+                words = raw[index:index + words_struct.size // 2]
+                value = value_struct.unpack(words_struct.pack(*reversed(words)))[0]
+            if scale != 1 or offset != 0:
+                value = value * scale + offset
+            values[name] = value
+
+
+class Plan:
+    """Grouped read requests for a RegisterMap, reusable for every scan"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def read(self, client, values=None):
+        """Execute the plan on client and return a dict of engineering values by point name"""
+        if values is None:
+            values = {}
+        for block in self.blocks:
+            unit = block.unit
+            if unit is None:
+                unit = client._default_unit_id
+            response = client._send_receive(unit, block.modbus_pdu, True)
+            block.decode(response, values)
+
+        return values
+
+
+class RegisterMap:
+    """A list of named points describing a device's registers
+
+    Points are dicts (or Point instances) with a name and address, and
+    optionally table, type, scale, offset, word_order and unit. Points in the
+    same table whose addresses are no more than max_gap registers (or
+    max_bit_gap bits) apart are read with one request.
+    """
+
+    def __init__(self, points, *, max_gap=8, max_bit_gap=64):
+        self.points = [point if isinstance(point, Point) else Point(**point) for point in points]
+        self.max_gap = max_gap
+        self.max_bit_gap = max_bit_gap
+        self._plan = None
+
+    @classmethod
+    def from_json(cls, stream, **kwargs):
+        """Load points from a JSON list, or an object with a "points" list"""
+        import json
+        data = json.load(stream)
+        if isinstance(data, dict):
+            data = data['points']
+        return cls(data, **kwargs)
+
+    @classmethod
+    def from_csv(cls, stream, **kwargs):
+        """Load points from CSV text with a header row naming the point fields"""
+        lines = [line.strip() for line in stream if line.strip() and not line.startswith('#')]
+        header = [field.strip() for field in lines[0].split(',')]
+        points = []
+        for line in lines[1:]:
+            point = {}
+            for field, text in zip(header, line.split(',')):
+                text = text.strip()
+                if field not in _FIELDS or text == '':
+                    continue
+                if field in ('address', 'unit'):
+                    point[field] = int(text, 0)
+                elif field in ('scale', 'offset'):
+                    point[field] = float(text)
+                else:
+                    point[field] = text
+            points.append(point)
+        return cls(points, **kwargs)
+
+    def compile(self):
+        """Group the points into as few requests as possible and precompute their decoders"""
+        groups = {}
+        for point in self.points:
+            groups.setdefault((point.unit, point.table), []).append(point)
+
+        blocks = []
+        for (unit, table), points in groups.items():
+            points.sort(key=lambda point: point.address)
+            max_quantity = TABLES[table][3]
+            max_gap = self.max_bit_gap if TABLES[table][2] else self.max_gap
+            current = [points[0]]
+            end = points[0].address + points[0].size
+            for point in points[1:]:
+                point_end = point.address + point.size
+                if (point.address < end or point.address - end > max_gap or
+                        point_end - current[0].address > max_quantity):
+                    blocks.append(_Block(unit, table, current[0].address, end - current[0].address, current))
+                    current = []
+                    end = point.address
+                current.append(point)
+                end = max(end, point_end)
+            blocks.append(_Block(unit, table, current[0].address, end - current[0].address, current))
+
+        self._plan = Plan(blocks)
+        return self._plan
+
+    def read(self, client, values=None):
+        """Read every point from client, compiling the plan on first use"""
+        if self._plan is None:
+            self.compile()
+        return self._plan.read(client, values)
+
+    def create_server(self, server_class, *args, **kwargs):
+        """Create a server simulator with banks large enough for every point"""
+        for table, (_, bank, _, _) in TABLES.items():
+            sizes = [point.address + point.size for point in self.points if point.table == table]
+            if sizes:
+                kwargs.setdefault('number_' + bank, max(sizes))
+        return server_class(*args, **kwargs)
+
+    def write_server(self, server, values):
+        """Store engineering values by point name into the banks of server"""
+        for point in self.points:
+            if point.name not in values:
+                continue
+            value = values[point.name]
+            bank = getattr(server, TABLES[point.table][1])
+            if point.type == 'bool':
+                bank[point.address] = int(bool(value))
+                continue
+
+            code = TYPES[point.type][0]
+            value = (value - point.offset) / point.scale
+            if code not in 'fd':
+                value = int(round(value))
+            raw = struct.pack('>' + code, value)
+            words = [raw[i:i + 2] for i in range(0, len(raw), 2)]
+            if point.word_order == 'little':
+                words.reverse()
+            bank.raw[point.address:point.address + len(words)] = words
@@ -0,0 +1,282 @@
+# Record Modbus traffic and replay it to check that wire behaviour is unchanged
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+#
+# Record a session, then replay it after changing the library:
+#
+#   recorder = Recorder(open('session.mbr', 'wb'))
+#   recorder.record_server(mb_server) # or recorder.record_client(mb_client)
+#   ...
+#   recorder.close()
+#
+#   records = read_recording(open('session.mbr', 'rb'))
+#   print(replay_server(records, Server(1, number_holding_registers=100)))
+#   print(replay_client(records))
+
+import struct
+import time
+import uModBus.const as Const
+from uModBus.common import Client, ModbusException, ModbusExceptionResponse, Timeout
+
+RECORDING_MAGIC = b'MBREC\x01'
+
+CLIENT_EXCHANGE = 0
+SERVER_EXCHANGE = 1
+
+STATUS_OK = 0
+STATUS_EXCEPTION = 1 # response holds the exception code
+STATUS_NO_RESPONSE = 2
+
+# time since start, response time, kind, status, count, request length, response length
+_RECORD = struct.Struct('<dfBBBHH')
+
+
+class Record:
+    """One request and its response; request is the unit id followed by the PDU"""
+
+    def __init__(self, timestamp, elapsed, kind, status, count, request, response):
+        self.timestamp = timestamp
+        self.elapsed = elapsed
+        self.kind = kind
+        self.status = status
+        self.count = count
+        self.request = request
+        self.response = response
+
+    @property
+    def unit(self):
+        return self.request[0]
+
+    @property
+    def function_code(self):
+        return self.request[1]
+
+
+def read_recording(stream):
+    """Return the records of a recording written by Recorder"""
+    if stream.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+        raise ValueError('not a Modbus recording')
+    records = []
+    while True:
+        header = stream.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return records
+        timestamp, elapsed, kind, status, count, request_length, response_length = _RECORD.unpack(header)
+        request = stream.read(request_length)
+        response = stream.read(response_length)
+        records.append(Record(timestamp, elapsed, kind, status, bool(count), request, response))
+
+
+class Recorder:
+    """Write the exchanges of clients and servers to a binary stream
+
+    record_client wraps Client._send_receive and stores the response data it
+    returns. record_server wraps Server.handle_request and Server._send and
+    stores the unit id and PDU that were sent back.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._started = time.monotonic()
+        stream.write(RECORDING_MAGIC)
+
+    def _write(self, stamp, elapsed, kind, status, count, request, response):
+        self._stream.write(_RECORD.pack(stamp - self._started, elapsed, kind, status, count,
+                                        len(request), len(response)))
+        self._stream.write(request)
+        self._stream.write(response)
+
+    def record_client(self, client):
+        send_receive = client._send_receive
+
+        def recorded(slave_addr, modbus_pdu, count):
+            request = bytes((slave_addr,)) + bytes(modbus_pdu)
+            stamp = time.monotonic()
+            status = STATUS_NO_RESPONSE
+            response = b''
+            try:
+                data = send_receive(slave_addr, modbus_pdu, count)
+                status = STATUS_OK
+                response = bytes(data)
+                return data
+            except ModbusExceptionResponse as e:
+                status = STATUS_EXCEPTION
+                response = bytes((e.exception_code,))
+                raise
+            finally:
+                self._write(stamp, time.monotonic() - stamp, CLIENT_EXCHANGE, status, count, request, response)
+
+        client._send_receive = recorded
+
+    def record_server(self, server):
+        handle_request = server.handle_request
+        send = server._send
+        sent = []
+
+        def recorded_send(modbus_pdu, slave_addr):
+            sent.append(bytes((slave_addr,)) + bytes(modbus_pdu))
+            send(modbus_pdu, slave_addr)
+
+        def recorded(data):
+            request = bytes(data)
+            sent.clear()
+            stamp = time.monotonic()
+            try:
+                return handle_request(data)
+            finally:
+                elapsed = time.monotonic() - stamp
+                status = STATUS_OK if sent else STATUS_NO_RESPONSE
+                self._write(stamp, elapsed, SERVER_EXCHANGE, status, False, request, sent[0] if sent else b'')
+
+        server._send = recorded_send
+        server.handle_request = recorded
+
+    def close(self):
+        self._stream.close()
+
+
+class ReplayReport:
+    def __init__(self, elapsed, counts, times, mismatches):
+        self.elapsed = elapsed
+        self.counts = counts
+        self.times = times
+        # (record index, expected, actual)
+        self.mismatches = mismatches
+
+    @property
+    def ok(self):
+        return not self.mismatches
+
+    def throughput(self, function_code):
+        """Requests per second spent on function_code"""
+        spent = self.times.get(function_code)
+        return self.counts[function_code] / spent if spent else 0
+
+    def __str__(self):
+        total = sum(self.counts.values())
+        lines = [f'{total} exchanges in {self.elapsed:.3f}s, {len(self.mismatches)} mismatches']
+        for function_code in sorted(self.counts):
+            lines.append(f'FC{function_code:02d} {self.counts[function_code]:6d} requests '
+                         f'{self.throughput(function_code):10.0f} req/s')
+        for index, expected, actual in self.mismatches[:10]:
+            lines.append(f'record {index}: expected {expected.hex()}, got {actual.hex()}')
+        return '\n'.join(lines)
+
+
+def replay_server(records, server):
+    """Feed the recorded requests to server at full speed and compare its responses
+
+    server must start in the same state as the one that was recorded.
+    """
+    sent = []
+    server._send = lambda modbus_pdu, slave_addr: sent.append(bytes((slave_addr,)) + bytes(modbus_pdu))
+    counts = {}
+    times = {}
+    mismatches = []
+    started = time.monotonic()
+    for index, record in enumerate(records):
+        if record.kind != SERVER_EXCHANGE:
+            continue
+        sent.clear()
+        stamp = time.monotonic()
+        try:
+            server.handle_request(record.request)
+        except ModbusException as e:
+            # answered the way the transports answer it
+            server.send_exception_response(record.request[0], e.function_code, e.exception_code)
+        elapsed = time.monotonic() - stamp
+        function_code = record.function_code
+        counts[function_code] = counts.get(function_code, 0) + 1
+        times[function_code] = times.get(function_code, 0) + elapsed
+        actual = sent[0] if sent else b''
+        if actual != record.response:
+            mismatches.append((index, record.response, actual))
+
+    return ReplayReport(time.monotonic() - started, counts, times, mismatches)
+
+
+class ReplayClient(Client):
+    """A Client whose transport answers from recorded client exchanges
+
+    Every request must match the recording byte for byte. With timing set
+    each response is delayed by its recorded response time.
+    """
+
+    def __init__(self, records, *, timing=True):
+        super().__init__(records[0].unit if records else 0)
+        self.records = records
+        self.timing = timing
+        self.mismatches = []
+        self._index = 0
+
+    def _send_receive(self, slave_addr, modbus_pdu, count):
+        record = self.records[self._index]
+        self._index += 1
+        request = bytes((slave_addr,)) + bytes(modbus_pdu)
+        if request != record.request or count != record.count:
+            self.mismatches.append((self._index - 1, record.request, request))
+        if self.timing:
+            time.sleep(record.elapsed)
+        if record.status == STATUS_EXCEPTION:
+            raise ModbusExceptionResponse(modbus_pdu[0], record.response[0], slave_addr)
+        if record.status == STATUS_NO_RESPONSE:
+            raise Timeout(slave_addr, modbus_pdu[0])
+        return record.response
+
+
+def _bits(data, quantity):
+    return [(data[i >> 3] >> (i & 7)) & 1 for i in range(quantity)]
+
+
+# function code -> (Client method, argument builder(pdu))
+_CLIENT_CALLS = {
+    Const.READ_COILS: ('read_coils', lambda pdu: struct.unpack_from('>HH', pdu, 1)),
+    Const.READ_DISCRETE_INPUTS: ('read_discrete_inputs', lambda pdu: struct.unpack_from('>HH', pdu, 1)),
+    Const.READ_HOLDING_REGISTERS: ('read_holding_registers', lambda pdu: struct.unpack_from('>HH', pdu, 1)),
+    Const.READ_INPUT_REGISTER: ('read_input_registers', lambda pdu: struct.unpack_from('>HH', pdu, 1)),
+    Const.WRITE_SINGLE_COIL: ('write_single_coil', lambda pdu: (struct.unpack_from('>H', pdu, 1)[0], int(pdu[3] == 0xFF))),
+    Const.WRITE_SINGLE_REGISTER: ('write_single_register', lambda pdu: struct.unpack_from('>HH', pdu, 1)),
+    Const.WRITE_MULTIPLE_COILS: ('write_multiple_coils',
+                                 lambda pdu: (struct.unpack_from('>H', pdu, 1)[0], _bits(pdu[6:], struct.unpack_from('>H', pdu, 3)[0]))),
+    Const.WRITE_MULTIPLE_REGISTERS: ('write_multiple_registers',
+                                     lambda pdu: (struct.unpack_from('>H', pdu, 1)[0], list(struct.unpack_from('>' + 'H' * (pdu[5] // 2), pdu, 6)))),
+}
+
+_UNSIGNED = ('read_holding_registers', 'read_input_registers', 'write_single_register', 'write_multiple_registers')
+
+
+def replay_client(records, *, timing=True):
+    """Repeat the recorded client requests through the Client API against a ReplayClient
+
+    Requests of the common function codes go through the Client method that
+    builds them, others are replayed at the transport level.
+    """
+    records = [record for record in records if record.kind == CLIENT_EXCHANGE]
+    client = ReplayClient(records, timing=timing)
+    counts = {}
+    times = {}
+    started = time.monotonic()
+    for index, record in enumerate(records):
+        # keep the transport in step with the recording even if a call fails early
+        client._index = index
+        unit = record.unit
+        pdu = record.request[1:]
+        function_code = record.function_code
+        stamp = time.monotonic()
+        try:
+            call = _CLIENT_CALLS.get(function_code)
+            if call is None:
+                client._send_receive(unit, pdu, record.count)
+            else:
+                method, build = call
+                kwargs = {'signed': False} if method in _UNSIGNED else {}
+                getattr(client, method)(*build(pdu), unit=unit, **kwargs)
+        except (ModbusExceptionResponse, Timeout):
+            pass
+        elapsed = time.monotonic() - stamp
+        counts[function_code] = counts.get(function_code, 0) + 1
+        times[function_code] = times.get(function_code, 0) + elapsed
+
+    return ReplayReport(time.monotonic() - started, counts, times, client.mismatches)
@@ -9,8 +9,10 @@
 
 import time
 import struct
+from array import array
 import uModBus.const as Const
 from uModBus.common import ModbusException
+from uModBus.common import ModbusExceptionResponse, CRCError, TransactionMismatch, Timeout
 from uModBus.common import Server, Client
 
 def _t35chars_time(baudrate, data_bits, stop_bits):
@@ -29,13 +31,48 @@ def _rtu_send(ctx, modbus_pdu, slave_addr):
     ctx._uart.write(serial_pdu)
     time.sleep(ctx._t35chars)
 
-def _calculate_crc16(data):
+def _rtu_frame_in_place(server, modbus_pdu, slave_addr):
+    """Complete the RTU frame around modbus_pdu in the response buffer of server and return a view of it"""
+    size = server._place_pdu(modbus_pdu)
+    adu = server._adu
+    adu[0] = slave_addr
+    crc = _crc16(server._adu_buffer(1 + size))
+    adu[1 + size] = crc & 0xFF
+    adu[2 + size] = crc >> 8
+    return server._adu_buffer(3 + size)
+
+_crc16_table = None
+
+def _build_crc16_table():
+    # built on first use instead of being stored as a literal, saving import time and RAM
+    global _crc16_table
+    table = array('H', [0] * 256)
+    for index in range(256):
+        crc = 0x0000
+        byte = index
+        for _ in range(8):
+            if (byte ^ crc) & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+            byte >>= 1
+        table[index] = crc
+    _crc16_table = table
+    return table
+
+def _crc16(data):
+    table = _crc16_table
+    if table is None:
+        table = _build_crc16_table()
     crc = 0xFFFF
 
     for char in data:
-        crc = (crc >> 8) ^ Const.CRC16_TABLE[((crc) ^ char) & 0xFF]
+        crc = (crc >> 8) ^ table[((crc) ^ char) & 0xFF]
 
-    return struct.pack('<H',crc)
+    return crc
+
+def _calculate_crc16(data):
+    return struct.pack('<H', _crc16(data))
 
 def _uart_read_frame(ctx, timeout=None):
     frame = bytearray()
@@ -49,58 +86,196 @@ def _uart_read_frame(ctx, timeout=None):
                 r = ctx._uart.read(waiting)
                 frame.extend(r)
                 last_byte_ts = time.monotonic()
-        if len(frame) >= 8:
+        if len(frame) >= Const.MIN_RTU_FRAME_LEN:
             return frame
 
     return None
 
+# function codes whose frame length depends on bytes after the function code
+_VARIABLE_LENGTH = (Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS, Const.READ_WRITE_MULTIPLE_REGISTERS,
+                    Const.READ_FIFO_QUEUE, Const.READ_DEVICE_IDENTIFICATION)
+
+def _rtu_request_length(frame):
+    """Return the expected length of an RTU request, or None if it cannot be known yet"""
+    function_code = frame[1]
+    if function_code <= Const.WRITE_SINGLE_REGISTER or function_code == Const.DIAGNOSTICS:
+        return Const.FIXED_RESP_LEN
+    elif function_code in (Const.READ_EXCEPTION_STATUS, Const.GET_COM_EVENT_COUNTER,
+                           Const.GET_COM_EVENT_LOG, Const.REPORT_SERVER_ID):
+        return Const.MIN_RTU_FRAME_LEN
+    elif function_code in (Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS):
+        if len(frame) < 7:
+            return None
+        return 7 + frame[6] + Const.CRC_LENGTH
+    elif function_code in (Const.READ_FILE_RECORD, Const.WRITE_FILE_RECORD):
+        return Const.RESPONSE_HDR_LENGTH + 1 + frame[2] + Const.CRC_LENGTH
+    elif function_code == Const.MASK_WRITE_REGISTER:
+        return 10
+    elif function_code == Const.READ_WRITE_MULTIPLE_REGISTERS:
+        if len(frame) < 11:
+            return None
+        return 11 + frame[10] + Const.CRC_LENGTH
+    elif function_code == Const.READ_FIFO_QUEUE:
+        return 6
+    elif function_code == Const.READ_DEVICE_IDENTIFICATION:
+        return 7
+    return None
+
+def _rtu_response_length(frame):
+    """Return the expected length of an RTU response, or None if it cannot be known yet"""
+    function_code = frame[1]
+    if function_code >= Const.ERROR_BIAS:
+        return Const.ERROR_RESP_LEN
+    elif function_code <= Const.READ_INPUT_REGISTER or function_code in (
+            Const.GET_COM_EVENT_LOG, Const.REPORT_SERVER_ID, Const.READ_FILE_RECORD,
+            Const.WRITE_FILE_RECORD, Const.READ_WRITE_MULTIPLE_REGISTERS):
+        return Const.RESPONSE_HDR_LENGTH + 1 + frame[2] + Const.CRC_LENGTH
+    elif function_code in (Const.WRITE_SINGLE_COIL, Const.WRITE_SINGLE_REGISTER, Const.DIAGNOSTICS,
+                           Const.GET_COM_EVENT_COUNTER, Const.WRITE_MULTIPLE_COILS, Const.WRITE_MULTIPLE_REGISTERS):
+        return Const.FIXED_RESP_LEN
+    elif function_code == Const.READ_EXCEPTION_STATUS:
+        return Const.ERROR_RESP_LEN
+    elif function_code == Const.MASK_WRITE_REGISTER:
+        return 10
+    elif function_code == Const.READ_FIFO_QUEUE:
+        if len(frame) < 4:
+            return None
+        return Const.RESPONSE_HDR_LENGTH + 2 + ((frame[2] << 8) | frame[3]) + Const.CRC_LENGTH
+    elif function_code == Const.READ_DEVICE_IDENTIFICATION:
+        # unit, function code, MEI type, read code, conformity, more follows, next object, object count
+        offset = 8
+        if len(frame) < offset:
+            return None
+        for _ in range(frame[7]):
+            if len(frame) < offset + 2:
+                return None
+            offset += 2 + frame[offset + 1]
+        return offset + Const.CRC_LENGTH
+    return None
+
 def _validate_resp_hdr(response, slave_addr, function_code, count):
 
     if len(response) == 0:
-        raise OSError('no data received from slave')
+        raise Timeout(slave_addr, function_code)
 
     resp_crc = response[-Const.CRC_LENGTH:]
     expected_crc = _calculate_crc16(response[:-Const.CRC_LENGTH])
 
     if resp_crc != expected_crc:        
-        print(f"Bad CRC - \n\tReceived - {hex(resp_crc[0]) + hex(resp_crc[1])[-2:]} \n\t Expected - {hex(expected_crc[0]) + hex(expected_crc[1])[-2:]}")
-        raise OSError(f"Response was: {[hex(i) for i in response]}")
+        raise CRCError(resp_crc, expected_crc, response)
 
     if (response[0] != slave_addr):
-        raise ValueError('wrong slave address')
+        raise TransactionMismatch('slave address', slave_addr, response[0])
 
     if (response[1] == (function_code + Const.ERROR_BIAS)):
-        raise ValueError('slave returned exception code: {:d}'.format(response[2]))
+        raise ModbusExceptionResponse(function_code, response[2], slave_addr)
 
     hdr_length = Const.RESPONSE_HDR_LENGTH + int(count)
     return response[hdr_length:-Const.CRC_LENGTH]
 
+def _rtu_handle_frame(server, req):
+    """Check the length and CRC of a received RTU request and pass it to server"""
+    if len(req) > Const.MAX_RTU_ADU_LENGTH:
+        server.counters.bus_messages += 1
+        server.counters.overruns += 1
+        server._log_event(Const.EVENT_RECEIVE | Const.EVENT_RECEIVE_OVERRUN)
+        return None
+    req_no_crc = req[:-Const.CRC_LENGTH]
+    if _crc16(req_no_crc) != req[-2] | (req[-1] << 8):
+        server.counters.bus_messages += 1
+        server.counters.bus_errors += 1
+        server._log_event(Const.EVENT_RECEIVE | Const.EVENT_RECEIVE_COMM_ERROR)
+        return None
+
+    try:
+        return server.handle_request(req_no_crc)
+    except ModbusException as e:
+        server.send_exception_response(req[0], e.function_code, e.exception_code)
+        return None
+
+class _UnitTiming:
+    def __init__(self, size=32):
+        self._samples = [0.0] * size
+        self._next = 0
+        self.count = 0
+        self.failures = 0
+
+    def add(self, elapsed):
+        self._samples[self._next] = elapsed
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+
+    def percentile(self, pct):
+        """Return the pct percentile of the recent response times, or None with no samples"""
+        size = min(self.count, len(self._samples))
+        if size == 0:
+            return None
+        ordered = sorted(self._samples[:size])
+        return ordered[min(size - 1, int(size * pct / 100))]
+
 class RTUClient(Client):
-    def __init__(self, uart, *, default_unit_id=0x00, timeout=None, data_bits=8, stop_bits=1):
+    def __init__(self, uart, *, default_unit_id=0x00, timeout=None, data_bits=8, stop_bits=1,
+    retries=1, retry_backoff=2, adaptive_timeout=False, timeout_margin=2, min_timeout=None, min_samples=8):
         super().__init__(default_unit_id)
         self._uart = uart
         self.timeout = timeout
         self._t35chars = _t35chars_time(self._uart.baudrate, data_bits, stop_bits)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.adaptive_timeout = adaptive_timeout
+        self.timeout_margin = timeout_margin
+        self.min_timeout = (self._t35chars * 10) if min_timeout is None else min_timeout
+        self.min_samples = min_samples
+        self.unit_timeouts = {}
+        self._timing = {}
+
+    def unit_timing(self, unit):
+        """Return the response time statistics collected for a unit"""
+        timing = self._timing.get(unit)
+        if timing is None:
+            timing = _UnitTiming()
+            self._timing[unit] = timing
+        return timing
+
+    def unit_timeout(self, unit):
+        """Return the timeout used for the first attempt of a request to a unit"""
+        timeout = self.unit_timeouts.get(unit)
+        if timeout is not None:
+            return timeout
+        if self.adaptive_timeout:
+            timing = self._timing.get(unit)
+            if timing is not None and timing.count >= self.min_samples:
+                timeout = max(timing.percentile(99) * self.timeout_margin, self.min_timeout)
+                if self.timeout is not None:
+                    timeout = min(timeout, self.timeout)
+                return timeout
+        return self.timeout
+
+    def _poll_delay(self, unit):
+        # units that answer within a few character times are polled at a finer interval
+        timing = self._timing.get(unit)
+        if timing is not None and timing.count >= self.min_samples:
+            if timing.percentile(99) < self._t35chars * 4:
+                return self._t35chars / 2
+        return self._t35chars
 
     def _exit_read(self, response):
-        if response[1] >= Const.ERROR_BIAS:
-            if len(response) < Const.ERROR_RESP_LEN:
+        expected_len = _rtu_response_length(response)
+        if expected_len is None:
+            if response[1] in _VARIABLE_LENGTH:
                 return False
-        elif (Const.READ_COILS <= response[1] <= Const.READ_INPUT_REGISTER):
-            expected_len = Const.RESPONSE_HDR_LENGTH + 1 + response[2] + Const.CRC_LENGTH
-            if len(response) < expected_len:
-                return False
-        elif len(response) < Const.FIXED_RESP_LEN:
-            return False
+            expected_len = Const.FIXED_RESP_LEN
 
-        return True
+        return len(response) >= expected_len
 
-    def _uart_read(self):
+    def _uart_read(self, timeout=None, poll_delay=None):
+        if poll_delay is None:
+            poll_delay = self._t35chars
         response = bytearray()
         start = time.monotonic()
         while True:
             waiting = self._uart.in_waiting
-            time.sleep(self._t35chars)
+            time.sleep(poll_delay)
             if waiting > 0:
                 while waiting != self._uart.in_waiting: # give timeout period
                     time.sleep(self._t35chars)
@@ -111,8 +286,8 @@ class RTUClient(Client):
             if len(response) >= Const.ERROR_RESP_LEN and self._exit_read(response):
                 return response
 
-            if self.timeout is not None:
-                if time.monotonic() - start > self.timeout:
+            if timeout is not None:
+                if time.monotonic() - start > timeout:
                     return response
                     
 
@@ -120,50 +295,61 @@ class RTUClient(Client):
         _rtu_send(self, modbus_pdu, slave_addr)
 
     def _send_receive(self, slave_addr, modbus_pdu, count):
-        try:
-            self._uart.reset_input_buffer()
-            self._send(slave_addr, modbus_pdu)
-            resp = self._uart_read()
-            return _validate_resp_hdr(resp, slave_addr, modbus_pdu[0], count)
-        except (OSError, ValueError): # retry to help with devices with lax timing
-            time.sleep(self._t35chars * 2)
-            self._uart.reset_input_buffer()
-            self._send(slave_addr, modbus_pdu)
-            resp = self._uart_read()
-            return _validate_resp_hdr(resp, slave_addr, modbus_pdu[0], count)
+        timing = self.unit_timing(slave_addr)
+        timeout = self.unit_timeout(slave_addr)
+        poll_delay = self._poll_delay(slave_addr)
+        attempt = 0
+        while True:
+            try:
+                self._uart.reset_input_buffer()
+                self._send(slave_addr, modbus_pdu)
+                stamp = time.monotonic()
+                resp = self._uart_read(timeout, poll_delay)
+                elapsed = time.monotonic() - stamp
+                data = _validate_resp_hdr(resp, slave_addr, modbus_pdu[0], count)
+                timing.add(elapsed)
+                return data
+            except ModbusExceptionResponse:
+                # the device answered, asking again will not change the answer
+                timing.add(elapsed)
+                raise
+            except (OSError, ValueError): # retry to help with devices with lax timing
+                timing.failures += 1
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                time.sleep(self._t35chars * (self.retry_backoff ** attempt))
+                # later attempts fall back to the bus wide timeout
+                timeout = self.timeout
+                poll_delay = self._t35chars
 
 class RTUServer(Server):
+    # the unit address goes in front of the PDU
+    _pdu_offset = 1
+
     def __init__(self, uart, data_bits=8, stop_bits=1, *, unit_addr=1, number_coils=None, number_discrete_inputs=None,
-    number_input_registers=None, number_holding_registers=None):
+    number_input_registers=None, number_holding_registers=None, file_records=None, fifo_queues=None, policy=None):
         super().__init__(
             unit_addr, 
             number_coils=number_coils, 
             number_discrete_inputs=number_discrete_inputs, 
             number_input_registers=number_input_registers,
-            number_holding_registers=number_holding_registers
+            number_holding_registers=number_holding_registers,
+            file_records=file_records,
+            fifo_queues=fifo_queues,
+            policy=policy
             )
         
         self._uart = uart
         self._t35chars = _t35chars_time(self._uart.baudrate, data_bits, stop_bits)
 
     def _send(self, modbus_pdu, slave_addr):
-        _rtu_send(self, modbus_pdu, slave_addr)
+        self._uart.write(_rtu_frame_in_place(self, modbus_pdu, slave_addr))
+        time.sleep(self._t35chars)
 
     def poll(self, timeout=None):
         req = _uart_read_frame(self, timeout)
-        if req is None or len(req) < 8:
-            return None
-        req_crc = req[-Const.CRC_LENGTH:]
-        req_no_crc = req[:-Const.CRC_LENGTH]
-        expected_crc = _calculate_crc16(req_no_crc)
-        if (req_crc[0] != expected_crc[0]) or (req_crc[1] != expected_crc[1]):
-            print(f"Bad CRC - \n\tReceived - {hex(req_crc[0]) + hex(req_crc[1])[-2:]} \n\t Expected - {hex(expected_crc[0]) + hex(expected_crc[1])[-2:]}")
-            return None
-
-        try:
-            return self.handle_request(req_no_crc)
-        except ModbusException as e:
-            self.send_exception_response(req[0], e.function_code, e.exception_code)
-            print(f"Modbus Exception - {e.function_code} - {e.exception_code}")
+        if req is None or len(req) < Const.MIN_RTU_FRAME_LEN:
             return None
+        return _rtu_handle_frame(self, req)
 
@@ -0,0 +1,152 @@
+# Report by exception on top of a polling Client
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import struct
+import time
+from uModBus.common import _next_slot
+from uModBus.regmap import TABLES
+
+
+class Subscription:
+    """Poll a range of one table and report only the values that changed
+
+    table is 'coil', 'discrete', 'holding' or 'input'. Each poll compares the
+    raw response with the previous one, so an unchanged range costs a single
+    bytes comparison. Registers are reported when they move by more than
+    their deadband from the value last reported; deadband is a number for
+    the whole range or a dict of register address -> deadband. The first
+    poll reports every value.
+
+    Changes are delivered as a dict of address -> value, returned by poll(),
+    passed to callback and produced by iterating with async for.
+    """
+
+    def __init__(self, client, table, start, quantity, *, rate=1, unit=None, deadband=0, signed=True, callback=None):
+        if table not in TABLES:
+            raise ValueError(f'unknown table {table}, expected one of {", ".join(TABLES)}')
+        request, _, bits, max_quantity = TABLES[table]
+        if not 1 <= quantity <= max_quantity:
+            raise ValueError(f'quantity must be between 1 and {max_quantity}')
+        self.client = client
+        self.table = table
+        self.start = start
+        self.quantity = quantity
+        self.period = 1 / rate
+        self.unit = unit
+        self.callback = callback
+        self._modbus_pdu = request(start, quantity)
+        self._bits = bits
+        self._struct = None if bits else struct.Struct('>' + ('h' if signed else 'H') * quantity)
+        self._deadbands = None
+        if not bits:
+            if isinstance(deadband, dict):
+                self._deadbands = [deadband.get(start + index, 0) for index in range(quantity)]
+            elif deadband:
+                self._deadbands = [deadband] * quantity
+        self._raw = None
+        self._reported = None
+        self._next_poll = time.monotonic()
+
+    def poll(self):
+        """Read the range once and return the changed values, also passing them to callback"""
+        unit = self.unit
+        if unit is None:
+            unit = self.client._default_unit_id
+        response = bytes(self.client._send_receive(unit, self._modbus_pdu, True))
+        if response == self._raw:
+            return {}
+
+        if self._bits:
+            changes = self._bit_changes(response)
+        else:
+            changes = self._register_changes(response)
+        self._raw = response
+        if changes and self.callback is not None:
+            self.callback(changes)
+        return changes
+
+    def reset(self):
+        """Forget the snapshot so the next poll reports every value again"""
+        self._raw = None
+        self._reported = None
+
+    def run(self, duration=None):
+        """Poll at the subscription rate for duration seconds, or forever"""
+        started = time.monotonic()
+        while duration is None or time.monotonic() - started < duration:
+            self._wait(time.sleep)
+            self.poll()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        import asyncio
+
+        while True:
+            delay = self._schedule()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            changes = self.poll()
+            if changes:
+                return changes
+
+    def _schedule(self):
+        """Return the seconds until the next poll, or advance the schedule and return 0 if it is due"""
+        now = time.monotonic()
+        if now < self._next_poll:
+            return self._next_poll - now
+        # skip missed slots instead of bursting to catch up
+        self._next_poll = _next_slot(self._next_poll, self.period, now)
+        return 0
+
+    def _wait(self, sleep):
+        delay = self._schedule()
+        while delay > 0:
+            sleep(delay)
+            delay = self._schedule()
+
+    def _bit_changes(self, response):
+        start = self.start
+        quantity = self.quantity
+        previous = self._raw
+        changes = {}
+        for index, byte in enumerate(response):
+            changed = 0xFF if previous is None else byte ^ previous[index]
+            if not changed:
+                continue
+            bit = index * 8
+            while changed and bit < quantity:
+                if changed & 1:
+                    changes[start + bit] = bool(byte & 1)
+                changed >>= 1
+                byte >>= 1
+                bit += 1
+        return changes
+
+    def _register_changes(self, response):
+        values = self._struct.unpack(response)
+        reported = self._reported
+        start = self.start
+        if reported is None:
+            self._reported = list(values)
+            return {start + index: value for index, value in enumerate(values)}
+
+        previous = self._raw
+        deadbands = self._deadbands
+        changes = {}
+        for index in range(self.quantity):
+            offset = index * 2
+            # skip words whose bytes did not change since the last poll
+            if response[offset] == previous[offset] and response[offset + 1] == previous[offset + 1]:
+                continue
+            value = values[index]
+            if deadbands is not None and abs(value - reported[index]) <= deadbands[index]:
+                continue
+            reported[index] = value
+            changes[start + index] = value
+        return changes
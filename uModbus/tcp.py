@@ -9,36 +9,286 @@
 
 import time
 import struct
-from random import getrandbits
 import uModBus.const as Const
-from uModBus.common import Server, Client
+from uModBus.common import Server, Client, _TokenBucket, _bucket_size
 from uModBus.common import ModbusException
+from uModBus.common import ModbusExceptionResponse, TransactionMismatch, Timeout
+
+
+_trans_id = 0
+
+def _next_trans_id():
+    global _trans_id
+    _trans_id = (_trans_id + 1) & 0xFFFF
+    return _trans_id
+
+
+class _MBAPReader:
+    """Reassemble MBAP frames from a TCP stream into a preallocated buffer
+
+    Frames are returned as memoryviews into the buffer and are only valid
+    until the next call to fill().
+    """
+
+    def __init__(self, size=Const.MAX_TCP_ADU_LENGTH * 2):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def reset(self):
+        """Discard any buffered data"""
+        self._start = 0
+        self._end = 0
+
+    def fill(self, sock):
+        """Receive from sock into the free space of the buffer, returning the number of bytes read"""
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+        elif self._end == len(self._buf):
+            # move the partial frame to the front, leaving room for at least one full ADU
+            size = self._end - self._start
+            self._view[:size] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = size
+        received = sock.recv_into(self._view[self._end:])
+        self._end += received
+        return received
+
+    def next_frame(self):
+        """Return the next complete ADU, or None if more data is needed"""
+        size = self._end - self._start
+        if size < Const.MBAP_HDR_LENGTH - 1:
+            return None
+        length = (self._buf[self._start + 4] << 8) | self._buf[self._start + 5]
+        if length < 2 or length > Const.MAX_TCP_ADU_LENGTH - Const.MBAP_HDR_LENGTH + 1:
+            # nothing after a bad header can be trusted, the connection has to be dropped
+            self.reset()
+            raise ValueError(f'invalid MBAP length {length}')
+        frame_length = Const.MBAP_HDR_LENGTH - 1 + length
+        if size < frame_length:
+            return None
+        frame = self._view[self._start:self._start + frame_length]
+        self._start += frame_length
+        return frame
+
+
+class _Connection:
+    def __init__(self, sock, key, reader=None):
+        self.sock = sock
+        self.key = key
+        self.last_used = time.monotonic()
+        self.reader = _MBAPReader() if reader is None else reader
+        # set when the stream lost its framing
+        self.broken = False
+
+
+class _NoLock:
+    """Stands in for threading.Condition on ports without threads"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def wait(self, timeout):
+        # nothing else can release a connection, just let the deadline pass
+        time.sleep(timeout)
+
+    def notify(self):
+        pass
+
+
+class ConnectionPool:
+    """Share TCP connections to a device between TCPClient instances
+
+    Connections are keyed by (host, port), opened lazily and reused by every
+    client talking to the same gateway regardless of unit id. The pool can be
+    used from several threads; when max_connections to a device are in use,
+    acquire waits up to acquire_timeout seconds for one to be released.
+    """
+
+    def __init__(self, socket, *, max_connections=4, timeout=5, idle_timeout=30, backoff=.5, max_backoff=30,
+                 acquire_timeout=5):
+        self._socket_source = socket
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._addrinfo = {}
+        self._idle = {}
+        self._in_use = {}
+        self._retry = {}
+        # imported here so that importing uModBus.tcp does not pull in threading
+        try:
+            from threading import Condition
+            self._lock = Condition()
+        except ImportError:
+            self._lock = _NoLock()
+
+    def acquire(self, host, port):
+        """Return an idle connection to (host, port), connecting if none is available"""
+        key = (host, port)
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                idle = self._idle.get(key)
+                now = time.monotonic()
+                while idle:
+                    conn = idle.pop()
+                    if now - conn.last_used > self.idle_timeout and not self._healthy(conn.sock):
+                        self._close(conn)
+                        continue
+                    self._in_use[key] += 1
+                    return conn
+
+                if self._in_use.get(key, 0) < self.max_connections:
+                    # claim the slot now, the connect itself runs without holding the lock
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise RuntimeError(f'Connection limit of {self.max_connections} reached for {host}:{port}')
+                self._lock.wait(remaining)
+
+        try:
+            return self._connect(key)
+        except Exception:
+            with self._lock:
+                self._in_use[key] -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, conn):
+        """Return a healthy connection to the pool"""
+        with self._lock:
+            self._in_use[conn.key] -= 1
+            conn.last_used = time.monotonic()
+            self._idle.setdefault(conn.key, []).append(conn)
+            self._lock.notify()
+
+    def discard(self, conn):
+        """Close a connection that failed while in use"""
+        with self._lock:
+            self._in_use[conn.key] -= 1
+            self._lock.notify()
+        self._close(conn)
+
+    def connected(self, host, port):
+        """Return if any connection to (host, port) is open"""
+        key = (host, port)
+        with self._lock:
+            return self._in_use.get(key, 0) > 0 or bool(self._idle.get(key))
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    self._close(conn)
+                idle.clear()
+
+    def _connect(self, key):
+        now = time.monotonic()
+        retry = self._retry.get(key)
+        if retry is not None and now < retry[0]:
+            raise OSError(f'Reconnect to {key[0]}:{key[1]} backing off for {retry[0] - now:.2f}s')
+
+        addrinfo = self._addrinfo.get(key)
+        if addrinfo is None:
+            addrinfo = self._socket_source.getaddrinfo(key[0], key[1])[0][-1]
+            self._addrinfo[key] = addrinfo
+
+        sock = self._socket_source.socket()
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(addrinfo)
+        except Exception:
+            sock.close()
+            delay = self.backoff if retry is None else min(retry[1] * 2, self.max_backoff)
+            self._retry[key] = (time.monotonic() + delay, delay)
+            raise
+
+        self._retry.pop(key, None)
+        return _Connection(sock, key)
+
+    def _healthy(self, sock):
+        connected = getattr(sock, '_connected', None)
+        if connected is not None:
+            return connected
+        # an idle connection should have nothing to read, pending data or EOF means it is stale
+        try:
+            sock.settimeout(0)
+            sock.recv(1)
+            return False
+        except OSError as e:
+            return isinstance(e, BlockingIOError)
+        finally:
+            sock.settimeout(self.timeout)
+
+    def _close(self, conn):
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
 
 
 class TCPClient(Client):
 
-    def __init__(self, socket, server_ip, *, server_port=502, default_unit_id=255, timeout=5):
+    def __init__(self, socket, server_ip, *, server_port=502, default_unit_id=255, timeout=5, pool=None):
         super().__init__(default_unit_id)
-        self._sock = socket.socket()
-        self._addrinfo = socket.getaddrinfo(server_ip, server_port)[0][-1]
-        self.connect()
-        self._sock.settimeout(timeout)
+        self._pool = pool
+        self._server_ip = server_ip
+        self._server_port = server_port
+        self._socket_source = socket
+        self._timeout = timeout
+        if pool is None:
+            self._sock = socket.socket()
+            self._addrinfo = socket.getaddrinfo(server_ip, server_port)[0][-1]
+            # bounds the connect as well, so an unreachable host fails after timeout seconds
+            self._sock.settimeout(timeout)
+            self.connect()
+            self._conn = _Connection(self._sock, (server_ip, server_port))
+        else:
+            self._sock = None
 
     def connect(self):
         """Connect to Server"""
-        self._sock.connect(self._addrinfo)
+        if self._pool is None:
+            self._sock.connect(self._addrinfo)
+            if hasattr(self, '_conn'):
+                self._conn.reader.reset()
     
+    def _reopen(self):
+        """Replace a connection whose response stream lost its framing"""
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        self._sock = self._socket_source.socket()
+        self._sock.settimeout(self._timeout)
+        self._conn.sock = self._sock
+        self._conn.broken = False
+        self.connect()
+
     def disconnect(self):
         """Disconnect from server"""
-        self._sock.disconnect()
+        if self._pool is None:
+            self._sock.disconnect()
 
     @property
     def connected(self):
         """Return if socket is connected to the server"""
+        if self._pool is not None:
+            return self._pool.connected(self._server_ip, self._server_port)
         return self._sock._connected
 
     def _create_mbap_hdr(self, slave_id, modbus_pdu):
-        trans_id = getrandbits(16) & 0xFFFF
+        trans_id = _next_trans_id()
         mbap_hdr = struct.pack('>HHHB', trans_id, 0, len(modbus_pdu) + 1, slave_id)
 
         return mbap_hdr, trans_id
@@ -46,55 +296,124 @@ class TCPClient(Client):
     def _validate_resp_hdr(self, response, trans_id, slave_id, function_code, count=False):
         rec_tid, rec_pid, rec_len, rec_uid, rec_fc, rec_ec = struct.unpack('>HHHBBB', response[:Const.MBAP_HDR_LENGTH + 2])
         if (trans_id != rec_tid):
-            raise ValueError('wrong transaction Id')
+            raise TransactionMismatch('transaction id', trans_id, rec_tid)
 
         if (rec_pid != 0):
-            raise ValueError('invalid protocol Id')
+            raise TransactionMismatch('protocol id', 0, rec_pid)
 
         if (slave_id != rec_uid):
-            raise ValueError('wrong slave Id')
+            raise TransactionMismatch('slave id', slave_id, rec_uid)
 
         if (rec_fc == (function_code + Const.ERROR_BIAS)):
-            raise ValueError('slave returned exception code: {:d}'.format(rec_ec))
+            raise ModbusExceptionResponse(function_code, rec_ec, slave_id)
 
         hdr_length = (Const.MBAP_HDR_LENGTH + 2) if count else (Const.MBAP_HDR_LENGTH + 1)
 
         return response[hdr_length:]
 
     def _send_receive(self, slave_id, modbus_pdu, count):
+        if self._pool is None:
+            if self._conn.broken:
+                self._reopen()
+            return self._transact(self._conn, slave_id, modbus_pdu, count)
+
+        conn = self._pool.acquire(self._server_ip, self._server_port)
+        try:
+            modbus_data = self._transact(conn, slave_id, modbus_pdu, count)
+        except ModbusExceptionResponse:
+            self._pool.release(conn)
+            raise
+        except Exception:
+            # the stream may hold a late response or have lost its framing
+            self._pool.discard(conn)
+            raise
+        self._pool.release(conn)
+
+        return modbus_data
+
+    def _transact(self, conn, slave_id, modbus_pdu, count):
         mbap_hdr, trans_id = self._create_mbap_hdr(slave_id, modbus_pdu)
-        self._sock.send(mbap_hdr + modbus_pdu)
+        sock = conn.sock
+        sock.send(mbap_hdr + modbus_pdu)
 
-        timeout = self._sock.gettimeout()
+        timeout = sock.gettimeout()
         stamp = time.monotonic()
 
-        while self._sock._available() < Const.MBAP_HDR_LENGTH and time.monotonic() - stamp < timeout:
-            pass
+        while True:
+            try:
+                response = conn.reader.next_frame()
+            except ValueError:
+                conn.broken = True
+                raise
+            if response is None:
+                if timeout is not None and time.monotonic() - stamp > timeout:
+                    raise Timeout(slave_id, modbus_pdu[0])
+                if _fill(conn, slave_id, modbus_pdu[0]) == 0:
+                    raise Timeout(slave_id, modbus_pdu[0])
+                continue
+            # responses to earlier requests that timed out are dropped
+            if ((response[0] << 8) | response[1]) == trans_id:
+                break
 
-        response = self._sock.recv(Const.MAX_MSG_LENGTH)
-        if len(response) == 0:
-            raise TimeoutError("No response received")
         modbus_data = self._validate_resp_hdr(response, trans_id, slave_id, modbus_pdu[0], count)
 
         return modbus_data
 
 
+def _fill(conn, slave_id, function_code):
+    """Receive more of a response, raising Timeout when the socket times out"""
+    try:
+        return conn.reader.fill(conn.sock)
+    except TimeoutError:
+        raise Timeout(slave_id, function_code)
+
+
+class _ServerConnection(_Connection):
+    def __init__(self, sock, key, weight, burst, reader=None):
+        super().__init__(sock, key, reader)
+        self.weight = weight
+        self.served = 0
+        self.bucket = _TokenBucket(burst)
+
+
 class TCPServer(Server):
+    """Modbus TCP server handling up to max_connections clients
+
+    Clients with pending requests are served round robin, weight requests at a
+    time (client_weights maps a client IP to its weight, default 1). With
+    request_rate set every connection gets a token bucket of request_burst
+    requests refilled at request_rate per second; requests beyond it wait in
+    the socket until tokens are available. When a new client connects while
+    max_connections are open, the least recently active connection is closed.
+    """
+
+    # responses are encoded behind the MBAP header, see Server._pdu_buffer
+    _pdu_offset = Const.MBAP_HDR_LENGTH
 
     def __init__(self, socket, local_ip, *, local_port=502, unit_addr=None, number_coils=None, number_discrete_inputs=None,
-    number_input_registers=None, number_holding_registers=None):
+    number_input_registers=None, number_holding_registers=None, file_records=None, fifo_queues=None, policy=None,
+    max_connections=1, request_rate=None, request_burst=None, client_weights=None):
         super().__init__(
             unit_addr, 
             number_coils=number_coils, 
             number_discrete_inputs=number_discrete_inputs, 
             number_input_registers=number_input_registers,
-            number_holding_registers=number_holding_registers
+            number_holding_registers=number_holding_registers,
+            file_records=file_records,
+            fifo_queues=fifo_queues,
+            policy=policy
             )
         self._sock = None
-        self._client_sock = None
         self._socket_source = socket
         self._local_ip = local_ip
         self._local_port = local_port
+        self.max_connections = max_connections
+        self.request_rate = request_rate
+        self.request_burst = _bucket_size(request_rate, request_burst)
+        self.client_weights = {} if client_weights is None else client_weights
+        self._connections = []
+        self._next = 0
+        self._current = None
 
 
     def _listen(self):
@@ -103,54 +422,109 @@ class TCPServer(Server):
 
         
     def _send(self, modbus_pdu, slave_addr):
-        size = len(modbus_pdu)
-        fmt = 'B' * size
-        adu = struct.pack('>HHHB', self._req_tid, 0, size + 1, slave_addr) + modbus_pdu
+        size = self._place_pdu(modbus_pdu)
+        struct.pack_into('>HHHB', self._adu, 0, self._req_tid, 0, size + 1, slave_addr)
         try:
-            self._client_sock.send(adu)
+            self._current.sock.send(self._adu_buffer(Const.MBAP_HDR_LENGTH + size))
         except Exception as e:
-            self._client_sock.close()
-            self._client_sock = None
+            self._close(self._current)
             raise e
 
+    def _close(self, conn):
+        conn.sock.close()
+        if conn in self._connections:
+            self._connections.remove(conn)
 
-    def _accept_request(self, accept_timeout):
-
-        start = time.monotonic()
+    def _accept(self, accept_timeout):
         self._sock.settimeout(accept_timeout)
-        while time.monotonic() - start < accept_timeout and (self._client_sock == None or self._client_sock._socket_closed == True):
-            try: 
-                self._client_sock, addr = self._sock.accept()
-            except TimeoutError:
-                pass
-        if self._client_sock == None:
+        try:
+            sock, addr = self._sock.accept()
+        except TimeoutError:
+            return
+        if len(self._connections) >= self.max_connections:
+            least_recent = self._connections[0]
+            for conn in self._connections:
+                if conn.last_used < least_recent.last_used:
+                    least_recent = conn
+            self._close(least_recent)
+        sock.settimeout(.000001)
+        self._connections.append(_ServerConnection(sock, addr[0], self.client_weights.get(addr[0], 1),
+                                                   self.request_burst, self._new_reader()))
+
+    def _new_reader(self):
+        return _MBAPReader()
+
+    def _has_token(self, conn):
+        if self.request_rate is None:
+            return True
+        return conn.bucket.refill(self.request_rate, self.request_burst)
+
+    def _read_frame(self, conn):
+        try:
+            req = conn.reader.next_frame()
+            if req is None and conn.sock._available() > 0:
+                conn.reader.fill(conn.sock)
+                req = conn.reader.next_frame()
+        except TimeoutError:
             return None
-        self._client_sock.settimeout(.000001)
-        while time.monotonic() - start < accept_timeout:
-            try: 
-                if self._client_sock._available() >= Const.MBAP_HDR_LENGTH:
-                    break
-            except TimeoutError:
-                pass
-        if self._client_sock._available() < Const.MBAP_HDR_LENGTH:
+        except ValueError:
+            self.counters.bus_errors += 1
+            self._close(conn)
             return None
-        req = self._client_sock.recv(Const.MAX_MSG_LENGTH)
-
-        req_header_no_uid = req[:Const.MBAP_HDR_LENGTH - 1]
-        self._req_tid, req_pid, req_len = struct.unpack('>HHH', req_header_no_uid)
-        req_uid_and_pdu = req[Const.MBAP_HDR_LENGTH - 1:Const.MBAP_HDR_LENGTH + req_len - 1]
-        if (req_pid != 0):
-            self._client_sock.close()
-            self._client_sock = None
+        return req
+
+    def _next_request(self):
+        connections = self._connections
+        for _ in range(len(connections)):
+            if self._next >= len(connections):
+                self._next = 0
+            conn = connections[self._next]
+            if conn.sock._socket_closed:
+                self._close(conn)
+                continue
+            req = self._read_frame(conn) if self._has_token(conn) else None
+            if req is not None:
+                conn.served += 1
+                if conn.served >= conn.weight:
+                    conn.served = 0
+                    self._next += 1
+                return conn, req
+            conn.served = 0
+            self._next += 1
+        return None, None
+
+    def _handle(self, conn, req):
+        if self.request_rate is not None:
+            conn.bucket.tokens -= 1
+        conn.last_used = time.monotonic()
+        self._current = conn
+        self.client_address = conn.key
+        return self._handle_adu(conn, req)
+
+    def _handle_adu(self, conn, req):
+        self._req_tid = (req[0] << 8) | req[1]
+        req_uid_and_pdu = req[Const.MBAP_HDR_LENGTH - 1:]
+        if req[2] or req[3]: # protocol id
+            self._close(conn)
             return None
         try:
             r = self.handle_request(req_uid_and_pdu)
             return r
         except ModbusException as e:
-            # print("Modbus request error:", e)
-            self.send_exception_response(req[0], e.function_code, e.exception_code)
+            self.send_exception_response(req[Const.MBAP_HDR_LENGTH - 1], e.function_code, e.exception_code)
             return None
 
+    def _accept_request(self, accept_timeout):
+        start = time.monotonic()
+        # only wait for a connection when there is nobody to serve
+        self._accept(accept_timeout if not self._connections else .000001)
+        while True:
+            conn, req = self._next_request()
+            if req is not None:
+                return self._handle(conn, req)
+            if time.monotonic() - start >= accept_timeout:
+                return None
+
     def poll(self, timeout=.000001):
         if self._sock == None or self._sock._socket_closed == True:
             self._sock = self._socket_source.socket()
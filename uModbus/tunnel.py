@@ -0,0 +1,128 @@
+# Modbus RTU frames tunnelled over TCP, as sent by serial device servers
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import time
+import uModBus.const as Const
+from uModBus.common import Timeout
+from uModBus.serial import _rtu_send, _rtu_frame_in_place, _rtu_request_length, _rtu_response_length, _validate_resp_hdr, _rtu_handle_frame
+from uModBus.serial import _VARIABLE_LENGTH
+from uModBus.tcp import TCPClient, TCPServer, _MBAPReader, _fill
+
+
+class _RTUReader(_MBAPReader):
+    """Split a TCP stream into RTU frames using the function code length rules
+
+    frame_length is _rtu_request_length or _rtu_response_length. Frames of
+    unknown function codes are assumed to arrive in one segment.
+    """
+
+    def __init__(self, frame_length, size=Const.MAX_RTU_ADU_LENGTH * 2):
+        super().__init__(size)
+        self._frame_length = frame_length
+
+    def next_frame(self):
+        size = self._end - self._start
+        if size < Const.MIN_RTU_FRAME_LEN:
+            return None
+        length = self._frame_length(self._view[self._start:self._end])
+        if length is None:
+            if self._buf[self._start + 1] in _VARIABLE_LENGTH:
+                return None
+            length = size
+        if length > Const.MAX_RTU_ADU_LENGTH:
+            self.reset()
+            raise ValueError(f'invalid RTU frame length {length}')
+        if size < length:
+            return None
+        frame = self._view[self._start:self._start + length]
+        self._start += length
+        return frame
+
+
+class _SocketPort:
+    """Stands in for the UART of _rtu_send in RTUOverTCPClient, writing frames to a socket"""
+
+    def __init__(self, sock=None):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.send(data)
+
+
+class RTUOverTCPClient(TCPClient):
+    """Client for RTU frames carried over a TCP connection
+
+    RTU frames have no transaction id, so requests cannot be pipelined or
+    share a pool. After a failed request any late response is discarded
+    before the next request is sent.
+    """
+
+    def __init__(self, socket, server_ip, *, server_port=502, default_unit_id=1, timeout=5):
+        super().__init__(socket, server_ip, server_port=server_port, default_unit_id=default_unit_id, timeout=timeout)
+        self._conn.reader = _RTUReader(_rtu_response_length)
+        self._uart = _SocketPort(self._sock)
+        self._t35chars = 0
+        self._stale = False
+
+    def _discard_pending(self, conn):
+        sock = conn.sock
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            while conn.reader.fill(sock):
+                conn.reader.reset()
+        except OSError:
+            pass
+        finally:
+            sock.settimeout(timeout)
+        conn.reader.reset()
+
+    def _transact(self, conn, slave_id, modbus_pdu, count):
+        if self._stale:
+            self._discard_pending(conn)
+            self._stale = False
+        try:
+            _rtu_send(self, modbus_pdu, slave_id)
+
+            sock = conn.sock
+            timeout = sock.gettimeout()
+            stamp = time.monotonic()
+            while True:
+                response = conn.reader.next_frame()
+                if response is not None:
+                    break
+                if timeout is not None and time.monotonic() - stamp > timeout:
+                    raise Timeout(slave_id, modbus_pdu[0])
+                if _fill(conn, slave_id, modbus_pdu[0]) == 0:
+                    raise Timeout(slave_id, modbus_pdu[0])
+
+            return _validate_resp_hdr(bytes(response), slave_id, modbus_pdu[0], count)
+        except Exception:
+            self._stale = True
+            raise
+
+
+class RTUOverTCPServer(TCPServer):
+    """Server for RTU frames carried over TCP connections
+
+    Takes the same arguments as TCPServer. CRC errors and oversized frames
+    are counted like on a serial line.
+    """
+
+    _pdu_offset = 1
+
+    def _new_reader(self):
+        return _RTUReader(_rtu_request_length)
+
+    def _handle_adu(self, conn, req):
+        return _rtu_handle_frame(self, req)
+
+    def _send(self, modbus_pdu, slave_addr):
+        try:
+            self._current.sock.send(_rtu_frame_in_place(self, modbus_pdu, slave_addr))
+        except Exception as e:
+            self._close(self._current)
+            raise e
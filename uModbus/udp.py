@@ -0,0 +1,132 @@
+# Modbus MBAP frames over UDP
+#
+# Written by FACTS Engineering
+# Copyright (c) 2023 FACTS Engineering, LLC
+# Licensed under the MIT license.
+
+import time
+import struct
+import uModBus.const as Const
+from uModBus.common import Server, Client, ModbusException, Timeout
+from uModBus.tcp import TCPClient
+
+
+class UDPClient(TCPClient):
+    """Client sending one MBAP frame per datagram
+
+    Datagrams can be lost, so a request without a response within timeout
+    is sent again, up to retries times, with the same transaction id. A
+    late answer to an earlier attempt is accepted, answers to older
+    requests and datagrams from other hosts are dropped.
+    """
+
+    def __init__(self, socket, server_ip, *, server_port=502, default_unit_id=255, timeout=1, retries=2):
+        Client.__init__(self, default_unit_id)
+        self._pool = None
+        self._server_ip = server_ip
+        self._server_port = server_port
+        self.timeout = timeout
+        self.retries = retries
+        self._addrinfo = socket.getaddrinfo(server_ip, server_port)[0][-1]
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._buf = bytearray(Const.MAX_TCP_ADU_LENGTH)
+        self._view = memoryview(self._buf)
+
+    def connect(self):
+        """UDP is connectionless, nothing to do"""
+        pass
+
+    def disconnect(self):
+        """Close the socket"""
+        self._sock.close()
+
+    @property
+    def connected(self):
+        return True
+
+    def _send_receive(self, slave_id, modbus_pdu, count):
+        mbap_hdr, trans_id = self._create_mbap_hdr(slave_id, modbus_pdu)
+        adu = mbap_hdr + modbus_pdu
+        sock = self._sock
+
+        for _ in range(self.retries + 1):
+            sock.sendto(adu, self._addrinfo)
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    size, address = sock.recvfrom_into(self._buf)
+                except OSError: # timed out
+                    break
+                if address[0] != self._addrinfo[0] or size < Const.MBAP_HDR_LENGTH + 2:
+                    continue
+                if ((self._buf[0] << 8) | self._buf[1]) != trans_id:
+                    continue
+                return self._validate_resp_hdr(self._view[:size], trans_id, slave_id, modbus_pdu[0], count)
+
+        raise Timeout(slave_id, modbus_pdu[0])
+
+
+class UDPServer(Server):
+    """Server answering MBAP frames received as datagrams
+
+    Each datagram holds one request, answered to the address it came from.
+    """
+
+    _pdu_offset = Const.MBAP_HDR_LENGTH
+
+    def __init__(self, socket, local_ip, *, local_port=502, unit_addr=None, number_coils=None, number_discrete_inputs=None,
+    number_input_registers=None, number_holding_registers=None, file_records=None, fifo_queues=None, policy=None):
+        super().__init__(
+            unit_addr,
+            number_coils=number_coils,
+            number_discrete_inputs=number_discrete_inputs,
+            number_input_registers=number_input_registers,
+            number_holding_registers=number_holding_registers,
+            file_records=file_records,
+            fifo_queues=fifo_queues,
+            policy=policy
+            )
+        self._sock = None
+        self._socket_source = socket
+        self._local_ip = local_ip
+        self._local_port = local_port
+        self._buf = bytearray(Const.MAX_TCP_ADU_LENGTH)
+        self._view = memoryview(self._buf)
+        self._peer = None
+        self._req_tid = 0
+
+    def _send(self, modbus_pdu, slave_addr):
+        size = self._place_pdu(modbus_pdu)
+        struct.pack_into('>HHHB', self._adu, 0, self._req_tid, 0, size + 1, slave_addr)
+        self._sock.sendto(self._adu_buffer(Const.MBAP_HDR_LENGTH + size), self._peer)
+
+    def poll(self, timeout=.000001):
+        if self._sock is None:
+            self._sock = self._socket_source.socket(self._socket_source.AF_INET, self._socket_source.SOCK_DGRAM)
+            self._sock.bind((self._local_ip, self._local_port))
+
+        self._sock.settimeout(timeout)
+        try:
+            size, address = self._sock.recvfrom_into(self._buf)
+        except OSError: # timed out
+            return None
+
+        if size < Const.MBAP_HDR_LENGTH + 1:
+            self.counters.bus_errors += 1
+            return None
+        self._req_tid, req_pid, req_len = struct.unpack_from('>HHH', self._buf, 0)
+        if req_pid != 0 or req_len != size - Const.MBAP_HDR_LENGTH + 1:
+            self.counters.bus_errors += 1
+            return None
+
+        self._peer = address
+        self.client_address = address[0]
+        try:
+            return self.handle_request(self._view[Const.MBAP_HDR_LENGTH - 1:size])
+        except ModbusException as e:
+            self.send_exception_response(self._buf[Const.MBAP_HDR_LENGTH - 1], e.function_code, e.exception_code)
+            return None